@@ -22,6 +22,7 @@ yabt py.test conftest
 """
 
 
+import copy
 import os
 import shutil
 import tempfile
@@ -59,6 +60,32 @@ def reset_parser():
     configargparse._parsers = {}
 
 
+# Map from (work dir, argv) to a config initialized with them (for tests)
+_CONFS = {}
+# Command line args of the basic & debug configs
+BASIC_ARGV = ['--non-interactive', '--no-build-cache', '--no-test-cache',
+              '--no-docker-cache', 'build']
+DEBUG_ARGV = ['--non-interactive', '-f', 'debug', '--no-build-cache',
+              '--no-test-cache', '--no-docker-cache', 'build']
+
+
+def init_conf(argv: list):
+    """Return a new (shallow) copy of the config for `argv` in the current
+       work dir.
+
+    The config is initialized (parsing args & project settings, and loading
+    plugins) only once per work dir & argv, and copied for every test, so
+    tests can override config attributes freely (but not mutate them).
+    """
+    key = (os.path.abspath(os.curdir), tuple(argv))
+    if key not in _CONFS:
+        reset_parser()
+        conf = cli.init_and_get_conf(argv)
+        yabt.extend.Plugin.load_plugins(conf)
+        _CONFS[key] = conf
+    return copy.copy(_CONFS[key])
+
+
 def yabt_project_fixture(project):
     orig_dir = os.getcwd()
     tests_work_dir = os.path.abspath(
@@ -138,29 +165,16 @@ def tmp_dir():
 
 @fixture
 def basic_conf():
-    reset_parser()
-    conf = cli.init_and_get_conf([
-        '--non-interactive', '--no-build-cache', '--no-test-cache',
-        '--no-docker-cache', 'build'])
-    yabt.extend.Plugin.load_plugins(conf)
-    yield conf
+    yield init_conf(BASIC_ARGV)
 
 
 @fixture()
 def debug_conf():
-    reset_parser()
-    conf = cli.init_and_get_conf([
-        '--non-interactive', '-f', 'debug', '--no-build-cache',
-        '--no-test-cache', '--no-docker-cache', 'build'])
-    yabt.extend.Plugin.load_plugins(conf)
-    yield conf
+    yield init_conf(DEBUG_ARGV)
 
 
 @fixture
 def nopolicy_conf():
-    reset_parser()
-    conf = cli.init_and_get_conf([
+    yield init_conf([
         '--non-interactive', '--no-build-cache', '--no-test-cache',
         '--no-docker-cache','--no-policies', 'build'])
-    yabt.extend.Plugin.load_plugins(conf)
-    yield conf
@@ -23,9 +23,10 @@ yabt Build context module
 
 
 import codecs
-from collections import defaultdict, deque
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
-from functools import reduce
+from functools import lru_cache, reduce
+import heapq
 import json
 import os
 from pathlib import PurePath
@@ -34,6 +35,7 @@ from subprocess import PIPE
 import sys
 import threading
 from time import time
+from typing import Iterable
 
 import networkx as nx
 from colorama import Fore, Style
@@ -43,10 +45,12 @@ from ostrich.utils.text import get_safe_path
 from yabt.cli import call_user_func
 from .caching import (get_prebuilt_targets, load_target_from_cache,
                       save_target_in_cache, save_test_in_cache)
+from .buildfile_utils import to_build_module
 from .config import Config
 from .docker import format_qualified_image_name
 from .extend import Plugin
-from .graph import get_ancestors, get_descendants, topological_sort
+from .graph import (get_ancestors, get_dependents_depths, get_descendants,
+                    topological_sort_descendants)
 from .logging import make_logger
 from .target_extraction import extractor
 from .target_utils import split_build_module, Target
@@ -56,6 +60,33 @@ from .utils import fatal, fatal_noexc
 logger = make_logger(__name__)
 
 
+@lru_cache(maxsize=4096)
+def _safe(part: str) -> str:
+    """Return a cached safe FS name for the workspace path part `part`."""
+    return get_safe_path(part)
+
+
+def _intern_target_names(target: Target):
+    """Intern the names of `target` & the targets it refers to, so the many
+       references to the same target name (maps, module sets, graph nodes &
+       edges, deps) share one string."""
+    target.name = sys.intern(target.name)
+    target.builder_name = sys.intern(target.builder_name)
+    if target.deps:
+        target.deps[:] = [sys.intern(dep) for dep in target.deps]
+    if target.buildenv:
+        target.buildenv = sys.intern(target.buildenv)
+
+
+def _name_conflict_message(target: Target, first: Target) -> str:
+    """Return the error message for registering `target` when `first` is
+       already registered with the same name."""
+    return (f'Target with name "{target.name}" ({target.builder_name} '
+            f'from module "{split_build_module(target.name)}") '
+            f'already exists - defined first as {first.builder_name} '
+            f'in module "{split_build_module(first.name)}"')
+
+
 class BuildContext:
     """Build Context class.
 
@@ -92,12 +123,20 @@ class BuildContext:
         self.processed_build_files = set()
         # Target graph is *not necessarily thread-safe*!
         self.target_graph = None
+        # A map from (order, target name) to the names of all the target
+        # dependencies in that order, memoized for the graph in `_deps_graph`
+        self._deps_memo = {}
+        self._deps_graph = None
         # # A *thread-safe* map from BuildEnv name to qualified Docker image
         # #  name for that BuildEnv
         # self.buildenv_images = {}
         # A dictionary for collecting metadata on build artifacts
         self.artifacts_metadata = {}
         self.context_lock = threading.Lock()
+        # A *thread-safe* pool of the `conf.jobs` build job slots, shared by
+        # the target scheduler (one slot per target being built) and builders
+        # that parallelize work within a target build (created per build)
+        self._job_slots = None
         self.global_cache = call_user_func(conf.settings, 'get_global_cache')
         self.global_cache_failures = 0
 
@@ -111,7 +150,7 @@ class BuildContext:
         any intermediate parent directories.
         """
         workspace_dir = os.path.join(self.conf.get_workspace_path(),
-                                     *(get_safe_path(part) for part in parts))
+                                     *(_safe(part) for part in parts))
         if not os.path.isdir(workspace_dir):
             # exist_ok=True in case of concurrent creation of the same dir
             os.makedirs(workspace_dir, exist_ok=True)
@@ -128,12 +167,32 @@ class BuildContext:
             os.makedirs(bin_dir, exist_ok=True)
         return bin_dir
 
+    def _get_dep_names(self, target_name: str, topological: bool) -> tuple:
+        """Return the names of all dependencies (descendants) of the target
+           named `target_name`, in topological or sorted order.
+
+        The result is memoized per target & order, and recomputed if the
+        target graph is replaced.
+        """
+        if self._deps_graph is not self.target_graph:
+            self._deps_memo = {}
+            self._deps_graph = self.target_graph
+        key = (topological, target_name)
+        dep_names = self._deps_memo.get(key)
+        if dep_names is None:
+            if topological:
+                dep_names = tuple(topological_sort_descendants(
+                    self.target_graph, target_name))
+            else:
+                dep_names = tuple(sorted(
+                    get_descendants(self.target_graph, target_name)))
+            self._deps_memo[key] = dep_names
+        return dep_names
+
     def walk_target_deps_topological_order(self, target: Target):
         """Generate all dependencies of `target` by topological sort order."""
-        all_deps = get_descendants(self.target_graph, target.name)
-        for dep_name in topological_sort(self.target_graph):
-            if dep_name in all_deps:
-                yield self.targets[dep_name]
+        for dep_name in self._get_dep_names(target.name, True):
+            yield self.targets[dep_name]
 
     def generate_direct_deps(self, target: Target):
         """Generate only direct dependencies of `target`."""
@@ -141,12 +200,12 @@ class BuildContext:
 
     def generate_dep_names(self, target: Target):
         """Generate names of all dependencies (descendants) of `target`."""
-        yield from sorted(get_descendants(self.target_graph, target.name))
+        yield from self._get_dep_names(target.name, False)
 
     def generate_all_deps(self, target: Target):
         """Generate all dependencies of `target` (the target nodes)."""
         yield from (self.targets[dep_name]
-                    for dep_name in self.generate_dep_names(target))
+                    for dep_name in self._get_dep_names(target.name, False))
 
     def register_target(self, target: Target):
         """Register a `target` instance in this build context.
@@ -155,18 +214,39 @@ class BuildContext:
         `targets_by_module` map, but is not added to the target graph until
         target extraction is completed (thread safety considerations).
         """
-        if target.name in self.targets:
-            first = self.targets[target.name]
-            raise NameError(
-                'Target with name "{0.name}" ({0.builder_name} from module '
-                '"{1}") already exists - defined first as '
-                '{2.builder_name} in module "{3}"'.format(
-                    target, split_build_module(target.name),
-                    first, split_build_module(first.name)))
+        _intern_target_names(target)
+        first = self.targets.get(target.name)
+        if first is not None:
+            raise NameError(_name_conflict_message(target, first))
         self.targets[target.name] = target
         self.targets_by_module[split_build_module(target.name)].add(
             target.name)
 
+    def register_targets(self, targets: Iterable[Target]):
+        """Register multiple `targets` instances in this build context.
+
+        Same as calling `register_target()` for every target in `targets`,
+        except that name conflicts (with already-registered targets, or among
+        `targets` themselves) are all detected up front and reported in a
+        single NameError, in which case none of `targets` are registered.
+        """
+        targets_map = self.targets
+        candidates = {}
+        conflicts = []
+        for target in targets:
+            _intern_target_names(target)
+            first = candidates.get(target.name) or targets_map.get(target.name)
+            if first is None:
+                candidates[target.name] = target
+            else:
+                conflicts.append(_name_conflict_message(target, first))
+        if conflicts:
+            raise NameError('\n'.join(conflicts))
+        targets_map.update(candidates)
+        by_module = self.targets_by_module
+        for target_name in candidates:
+            by_module[split_build_module(target_name)].add(target_name)
+
     def remove_target(self, target_name: str):
         """Remove (unregister) a `target` from this build context.
 
@@ -177,11 +257,11 @@ class BuildContext:
 
         Doesn't touch the target graph, if it exists.
         """
-        if target_name in self.targets:
-            del self.targets[target_name]
-        build_module = split_build_module(target_name)
-        if build_module in self.targets_by_module:
-            self.targets_by_module[build_module].remove(target_name)
+        self.targets.pop(target_name, None)
+        module_targets = self.targets_by_module.get(
+            split_build_module(target_name))
+        if module_targets is not None:
+            module_targets.discard(target_name)
 
     def get_target_extraction_context(self, build_file_path: str) -> dict:
         """Return a build file parser target extraction context.
@@ -190,11 +270,12 @@ class BuildContext:
         builder-name to target extraction function,
         for every registered builder.
         """
-        extraction_context = {}
-        for name, builder in Plugin.builders.items():
-            extraction_context[name] = extractor(name, builder,
-                                                 build_file_path, self)
-        return extraction_context
+        # resolving the build module is the same for all builders, and not
+        # cheap (involves FS access), so it's done once per build file
+        build_module = to_build_module(build_file_path, self.conf)
+        return {
+            name: extractor(name, builder, build_file_path, self, build_module)
+            for name, builder in Plugin.builders.items()}
 
     # def register_buildenv_image(self, name: str, docker_image: str):
     #     """Register a named BuildEnv Docker image in this build context."""
@@ -239,12 +320,22 @@ class BuildContext:
                 return True
             return False
 
-        ready_nodes = deque(sorted(
-            target_name for target_name in graph_copy.nodes
-            if is_ready(target_name)))
+        # ready nodes are kept in a heap, prioritized by depth, so targets
+        # on the critical path of the graph are built first
+        depths = get_dependents_depths(graph_copy)
+        ready_nodes = [(-depths[target_name], target_name)
+                       for target_name in graph_copy.nodes
+                       if is_ready(target_name)]
+        heapq.heapify(ready_nodes)
+        ready_lock = threading.Lock()
         produced_event = threading.Event()
         failed_event = threading.Event()
 
+        def push_ready(target_name):
+            with ready_lock:
+                heapq.heappush(ready_nodes,
+                               (-depths[target_name], target_name))
+
         def make_done_callback(target: Target):
             """Return a callable "done" notifier to
                report a target as processed."""
@@ -255,9 +346,9 @@ class BuildContext:
                     affected_nodes = list(sorted(
                         graph_copy.predecessors(target.name)))
                     graph_copy.remove_node(target.name)
-                    ready_nodes.extend(
-                        target_name for target_name in affected_nodes
-                        if is_ready(target_name))
+                    for target_name in affected_nodes:
+                        if is_ready(target_name):
+                            push_ready(target_name)
                     produced_event.set()
 
             return done_notifier
@@ -269,9 +360,9 @@ class BuildContext:
                when it's not necessary."""
 
             def retry_notifier():
-                """Mark target as retry, re-entering node to end of queue"""
+                """Mark target as retry, re-entering node to the queue"""
                 if graph_copy.has_node(target.name):
-                    ready_nodes.append(target.name)
+                    push_ready(target.name)
                     produced_event.set()
 
             return retry_notifier
@@ -326,7 +417,8 @@ class BuildContext:
                     return
                 produced_event.wait(0.5)
             produced_event.clear()
-            next_node = ready_nodes.popleft()
+            with ready_lock:
+                next_node = heapq.heappop(ready_nodes)[1]
             node = self.targets[next_node]
             node.done = make_done_callback(node)
             # TODO(bergden) retry assumes no need to update predecessors:
@@ -403,13 +495,13 @@ class BuildContext:
         if cmd_env:
             for key, value in cmd_env.items():
                 # TODO(itamar): escaping
-                docker_run.extend(['-e', '{}={}'.format(key, value)])
+                docker_run.extend(['-e', f'{key}={value}'])
         if platform.system() == 'Linux' and auto_uid:
             # Fix permissions for bind-mounted project dir
             # The fix is not needed when using Docker For Mac / Windows,
             # because it is somehow taken care of by the sharing mechanics
             docker_run.extend([
-                '-u', '{}:{}'.format(os.getuid(), os.getgid()),
+                '-u', f'{os.getuid()}:{os.getgid()}',
                 '-v', '/etc/shadow:/etc/shadow:ro',
                 '-v', '/etc/group:/etc/group:ro',
                 '-v', '/etc/passwd:/etc/passwd:ro',
@@ -434,22 +526,20 @@ class BuildContext:
             try:
                 sys.stdout.write(result.stdout.decode('utf-8'))
             except UnicodeEncodeError as e:
-                sys.stderr.write('tried writing the stdout of {},\n but it '
-                                 'has a problematic character:\n {}\n'
-                                 'partial hex dump of stdout:\n{}\n'
-                                 .format(docker_run, str(e),
-                                         codecs.encode(result.stdout, 'hex')
-                                         .decode('utf8')[:1000]))
+                hex_dump = codecs.encode(result.stdout, 'hex').decode('utf8')
+                sys.stderr.write(f'tried writing the stdout of {docker_run},\n'
+                                 f' but it has a problematic character:\n'
+                                 f' {e}\npartial hex dump of stdout:\n'
+                                 f'{hex_dump[:1000]}\n')
         if kwargs['stderr'] is PIPE:
             try:
                 sys.stderr.write(result.stderr.decode('utf-8'))
             except UnicodeEncodeError as e:
-                sys.stderr.write('tried writing the stderr of {},\n but it '
-                                 'has a problematic character:\n {}\n'
-                                 'partial hex dump of stderr:\n{}\n'
-                                 .format(docker_run, str(e),
-                                         codecs.encode(result.stderr, 'hex')
-                                         .decode('utf8')[:1000]))
+                hex_dump = codecs.encode(result.stderr, 'hex').decode('utf8')
+                sys.stderr.write(f'tried writing the stderr of {docker_run},\n'
+                                 f' but it has a problematic character:\n'
+                                 f' {e}\npartial hex dump of stderr:\n'
+                                 f'{hex_dump[:1000]}\n')
         return result
 
     def build_target(self, target: Target):
@@ -502,13 +592,13 @@ class BuildContext:
         # if any dependency of the target is dirty, then the target is dirty.
         # This isn't always true for targets that calculate their own hash.
         builder = Plugin.builders[target.builder_name]
-        if not builder.cache_json_func and \
-                any(self.targets[dep].is_dirty for dep in target.deps):
-            logger.info('Cannot use cache of target: {} because it has dirty '
-                        'dependencies: {}', target.name,
-                        [dep for dep in target.deps
-                         if self.targets[dep].is_dirty])
-            return False
+        if not builder.cache_json_func:
+            dirty_deps = [dep for dep in target.deps
+                          if self.targets[dep].is_dirty]
+            if dirty_deps:
+                logger.info('Cannot use cache of target: {} because it has '
+                            'dirty dependencies: {}', target.name, dirty_deps)
+                return False
         # if the target has a dirty buildenv then it's also dirty
         if target.buildenv and self.targets[target.buildenv].is_dirty:
             logger.info('Cannot use cache of target: {} because its buildenv '
@@ -516,8 +606,30 @@ class BuildContext:
             return False
         return True
 
+    def acquire_extra_jobs(self, max_jobs: int) -> int:
+        """Acquire up to `max_jobs` idle build job slots, without waiting,
+           and return the number of slots acquired.
+
+        Used by builders to run work concurrently within a target build
+        without exceeding the build-wide jobs limit.
+        Caller **must** call `release_extra_jobs()` with the returned number
+        when the work is done.
+        """
+        if self._job_slots is None:
+            return 0
+        acquired = 0
+        while acquired < max_jobs and self._job_slots.acquire(blocking=False):
+            acquired += 1
+        return acquired
+
+    def release_extra_jobs(self, num_jobs: int):
+        """Release `num_jobs` job slots acquired by `acquire_extra_jobs()`."""
+        for _ in range(num_jobs):
+            self._job_slots.release()
+
     def build_graph(self, run_tests: bool=False):
         built_targets = set(get_prebuilt_targets(self))
+        self._job_slots = threading.Semaphore(max(self.conf.jobs, 1))
 
         def build(target: Target):
             """Build `target` if it wasn't built already, and mark it built."""
@@ -608,15 +720,19 @@ class BuildContext:
                 else:
                     target.fail(ex)
 
+        def build_with_job_slot(target: Target):
+            with self._job_slots:
+                build(target)
+
         def build_in_pool(seq):
             jobs = self.conf.jobs
             # don't use thread pool in case of single worker
             if jobs > 1:
                 with ThreadPoolExecutor(max_workers=jobs) as executor:
-                    list(executor.map(build, seq))
+                    list(executor.map(build_with_job_slot, seq))
             else:
                 for target in seq:
-                    build(target)
+                    build_with_job_slot(target)
 
         logger.info('Marked {} targets as "pre-built" in cached base images',
                     len(built_targets))
@@ -663,4 +779,4 @@ class BuildContext:
 
 
 def format_for_cli(part):
-    return '"{}"'.format(part) if ' ' in part else part
+    return f'"{part}"' if ' ' in part else part
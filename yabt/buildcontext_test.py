@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016 Resonai Ltd. All rights reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+yabt Build context tests
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+:author: Itamar Ostricher
+"""
+
+
+import sys
+from unittest.mock import Mock
+
+import pytest
+
+from .buildcontext import BuildContext
+from .graph import build_target_dep_graph
+from .target_utils import Target
+
+
+def make_target(name, builder_name='FileGroup'):
+    target = Target(builder_name)
+    target.name = name
+    target.deps = []
+    return target
+
+
+def test_register_targets():
+    """Test bulk registration populates both target maps."""
+    build_context = BuildContext(Mock())
+    build_context.register_targets(
+        [make_target('foo:bar'), make_target('foo:baz'), make_target(':qux')])
+    assert {'foo:bar', 'foo:baz', ':qux'} == set(build_context.targets)
+    assert {'foo:bar', 'foo:baz'} == build_context.targets_by_module['foo']
+    assert {':qux'} == build_context.targets_by_module['']
+
+
+def test_register_targets_conflicts():
+    """Test bulk registration reports all conflicts and registers nothing."""
+    build_context = BuildContext(Mock())
+    build_context.register_target(make_target('foo:bar'))
+    with pytest.raises(NameError) as excinfo:
+        build_context.register_targets([
+            make_target('foo:baz'),
+            make_target('foo:bar', 'Alias'),
+            make_target('foo:baz', 'Alias'),
+        ])
+    assert ('Target with name "foo:bar" (Alias from module "foo") already '
+            'exists - defined first as FileGroup in module "foo"\n'
+            'Target with name "foo:baz" (Alias from module "foo") already '
+            'exists - defined first as FileGroup in module "foo"' ==
+            str(excinfo.value))
+    assert ['foo:bar'] == list(build_context.targets)
+    assert {'foo:bar'} == build_context.targets_by_module['foo']
+
+
+def test_remove_target():
+    """Test removing registered and unknown targets."""
+    build_context = BuildContext(Mock())
+    build_context.register_targets([make_target('foo:bar'),
+                                    make_target('foo:baz')])
+    build_context.remove_target('foo:bar')
+    assert ['foo:baz'] == list(build_context.targets)
+    assert {'foo:baz'} == build_context.targets_by_module['foo']
+    # removing unknown targets (in known and unknown modules) is a no-op
+    build_context.remove_target('foo:bar')
+    build_context.remove_target('spam:eggs')
+    assert ['foo:baz'] == list(build_context.targets)
+    assert 'spam' not in build_context.targets_by_module
+
+
+def test_register_targets_interns_names():
+    """Test that registered target names and deps are interned strings."""
+    build_context = BuildContext(Mock())
+    target = make_target(''.join(['foo', ':bar']))
+    target.deps = [''.join(['foo', ':baz'])]
+    build_context.register_target(target)
+    assert target.name is sys.intern('foo:bar')
+    assert target.deps[0] is sys.intern('foo:baz')
+
+
+def test_walk_target_deps_topological_order():
+    """Test the memoized topological walk follows target graph changes."""
+    build_context = BuildContext(Mock())
+    foo, bar, baz = (make_target(':foo'), make_target(':bar'),
+                     make_target(':baz'))
+    foo.deps = [':bar']
+    bar.deps = [':baz']
+    build_context.register_targets([foo, bar, baz])
+    build_target_dep_graph(build_context, None)
+    for _ in range(2):
+        assert [baz, bar] == list(
+            build_context.walk_target_deps_topological_order(foo))
+    # replacing the graph invalidates the memoized walks
+    foo.deps = [':baz']
+    bar.deps = []
+    build_target_dep_graph(build_context, None)
+    assert [baz] == list(build_context.walk_target_deps_topological_order(foo))
+
+
+def test_generate_all_deps():
+    """Test the memoized (sorted) dependencies follow target graph changes."""
+    build_context = BuildContext(Mock())
+    foo, bar, baz = (make_target(':foo'), make_target(':bar'),
+                     make_target(':baz'))
+    foo.deps = [':baz', ':bar']
+    build_context.register_targets([foo, bar, baz])
+    build_target_dep_graph(build_context, None)
+    for _ in range(2):
+        assert [bar, baz] == list(build_context.generate_all_deps(foo))
+        assert [':bar', ':baz'] == list(build_context.generate_dep_names(foo))
+    foo.deps = [':bar']
+    build_target_dep_graph(build_context, None)
+    assert [bar] == list(build_context.generate_all_deps(foo))
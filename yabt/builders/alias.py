@@ -24,13 +24,18 @@ yabt Alias Builder
 """
 
 
+import sys
+
 from ..extend import (
     register_builder_sig, register_manipulate_target_hook)
 
 
+_TAG_PRUNE = sys.intern('prune-me')
+
+
 register_builder_sig('Alias')
 
 
 @register_manipulate_target_hook('Alias')
 def manipulate_alias_target(build_context, target):
-    target.tags.add('prune-me')
+    target.tags.add(_TAG_PRUNE)
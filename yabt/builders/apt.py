@@ -24,17 +24,39 @@ yabt Apt Builders
 """
 
 
+import sys
+
 from ..extend import (
     PropType as PT, register_build_func, register_builder_sig,
     register_manipulate_target_hook)
 from ..utils import yprint
 
 
-LAUNCHPAD_URL = ('https://launchpad.net/api/1.0/'
-                 '~{ppa_owner}/+archive/{ppa_name}')
-LAUNCHPAD_SOURCE_LINE = ('deb http://ppa.launchpad.net/{ppa_owner}/{ppa_name}/'
-                         '{distro_id} {distro_codename} main')
-VALID_SOURCE_TYPES = frozenset(('deb',))  # 'deb-src'
+# Interned tags, so the tag sets of all apt targets share the same strings
+_TAG_INSTALLABLE = sys.intern('apt-installable')
+_TAG_REPOSITORY = sys.intern('apt-repository')
+# Mapping from AptPackage / AptGroup repository props to AptRepository props
+_REPOSITORY_PROPS_MAP = {
+    'repository': 'source',
+    'repo_key': 'key',
+    'repo_keyserver': 'keyserver',
+}
+
+
+def rename_props(props, props_map: dict):
+    """Rename `props` in-place according to `props_map` (old -> new name)."""
+    for old_name, new_name in props_map.items():
+        props[new_name] = props.pop(old_name)
+
+
+def apt_installable_manipulate_target(build_context, target):
+    """Manipulate target hook shared by AptPackage & AptGroup targets."""
+    tags, props = target.tags, target.props
+    tags.add(_TAG_INSTALLABLE)
+    if props.repository:
+        tags.add(_TAG_REPOSITORY)
+        # translate to AptRepository props
+        rename_props(props, _REPOSITORY_PROPS_MAP)
 
 
 register_builder_sig(
@@ -52,15 +74,8 @@ def apt_package_builder(build_context, target):
     yprint(build_context.conf, 'Fetch and cache Apt package', target)
 
 
-@register_manipulate_target_hook('AptPackage')
-def apt_package_manipulate_target(build_context, target):
-    target.tags.add('apt-installable')
-    if target.props.repository:
-        target.tags.add('apt-repository')
-        # translate to AptRepository props
-        target.props.source = target.props.pop('repository')
-        target.props.key = target.props.pop('repo_key')
-        target.props.keyserver = target.props.pop('repo_keyserver')
+register_manipulate_target_hook('AptPackage')(
+    apt_installable_manipulate_target)
 
 
 register_builder_sig(
@@ -77,15 +92,8 @@ def apt_group_builder(build_context, target):
     yprint(build_context.conf, 'Fetch and cache Apt packages', target)
 
 
-@register_manipulate_target_hook('AptGroup')
-def apt_group_manipulate_target(build_context, target):
-    target.tags.add('apt-installable')
-    if target.props.repository:
-        target.tags.add('apt-repository')
-        # translate to AptRepository props
-        target.props.source = target.props.pop('repository')
-        target.props.key = target.props.pop('repo_key')
-        target.props.keyserver = target.props.pop('repo_keyserver')
+register_manipulate_target_hook('AptGroup')(
+    apt_installable_manipulate_target)
 
 
 register_builder_sig(
@@ -103,4 +111,4 @@ def apt_repository_builder(build_context, target):
 
 @register_manipulate_target_hook('AptRepository')
 def apt_repository_manipulate_target(build_context, target):
-    target.tags.add('apt-repository')
+    target.tags.add(_TAG_REPOSITORY)
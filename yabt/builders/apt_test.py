@@ -22,9 +22,16 @@ yabt Apt builder tests
 """
 
 
+import json
+from os.path import join
+from unittest.mock import MagicMock, patch
+
 import pytest
 
-from ..pkgmgmt import parse_apt_repository
+from .apt import apt_installable_manipulate_target
+from ..pkgmgmt import (
+    expand_ppa, get_ppa_signing_key, parse_apt_repository,
+    resolve_ppa_signing_keys)
 from ..target_utils import Target
 
 
@@ -36,6 +43,14 @@ DISTRO = {
 }
 
 
+def launchpad_response(key, status_code=200):
+    """Return a mock Launchpad PPA info response with signing key `key`."""
+    response = MagicMock(status_code=status_code, content=json.dumps(
+        {'signing_key_fingerprint': key}).encode('utf8'))
+    response.__enter__.return_value = response
+    return response
+
+
 def test_apt_repository_simple_line():
     target = Target('AptRepository')
     llvm_repo = ('deb http://llvm.org/apt/trusty/ '
@@ -48,6 +63,18 @@ def test_apt_repository_simple_line():
     assert apt_key_cmd is None
 
 
+def test_expand_ppa():
+    assert (('deb http://ppa.launchpad.net/brightbox/ruby-ng/ubuntu trusty '
+             'main', 'brightbox', 'ruby-ng') ==
+            expand_ppa('ppa:brightbox/ruby-ng', DISTRO))
+
+
+def test_expand_ppa_default_name():
+    """Test that PPA name defaults to "ppa" when only owner is given."""
+    assert (('deb http://ppa.launchpad.net/git-core/ppa/ubuntu trusty main',
+             'git-core', 'ppa') == expand_ppa('ppa:git-core', DISTRO))
+
+
 @pytest.mark.slow
 def test_apt_repository_ppa_with_key():
     target = Target('AptRepository')
@@ -62,3 +89,125 @@ def test_apt_repository_ppa_with_key():
         '--recv 80F70E11F0F0D5F10CB20E62F5DA5F09C3173AA6')
     assert exp_ruby_ng_repo == source_line
     assert exp_ruby_ng_key_cmd == apt_key_cmd
+
+
+def test_apt_repository_ppa_memoized():
+    """Test that a PPA referenced by multiple targets is fetched once."""
+    response = launchpad_response('C0FFEE')
+    targets = []
+    for _ in range(3):
+        target = Target('AptRepository')
+        target.props.source = 'ppa:yabt-test/memoized'
+        target.props.key = None
+        target.props.keyserver = 'hkp://keyserver.ubuntu.com:80'
+        targets.append(target)
+    with patch('yabt.pkgmgmt._SESSION.get',
+               return_value=response) as mock_get:
+        results = [parse_apt_repository(None, target, DISTRO)
+                   for target in targets]
+    mock_get.assert_called_once()
+    assert all(target.props.key == 'C0FFEE' for target in targets)
+    assert [(
+        'deb http://ppa.launchpad.net/yabt-test/memoized/ubuntu trusty main',
+        'apt-key adv --keyserver hkp://keyserver.ubuntu.com:80 --recv C0FFEE',
+    )] * 3 == results
+
+
+def test_resolve_ppa_signing_keys():
+    """Test that PPA signing keys are fetched once per PPA in advance."""
+
+    def launchpad_get(url, **unused_kwargs):
+        return launchpad_response(url.rsplit('/', 1)[-1].upper())
+
+    targets = []
+    for ppa in ('ppa:yabt-test/foo', 'ppa:yabt-test/bar', 'ppa:yabt-test/foo',
+                'deb http://llvm.org/apt/trusty/ llvm-toolchain-trusty main'):
+        target = Target('AptRepository')
+        target.props.source = ppa
+        target.props.key = None
+        target.props.keyserver = 'hkp://keyserver.ubuntu.com:80'
+        targets.append(target)
+    with patch('yabt.pkgmgmt._SESSION.get',
+               side_effect=launchpad_get) as mock_get:
+        resolve_ppa_signing_keys(None, targets)
+        assert 2 == mock_get.call_count
+        for target in targets:
+            parse_apt_repository(None, target, DISTRO)
+        assert 2 == mock_get.call_count
+    assert (['FOO', 'BAR', 'FOO', None] ==
+            [target.props.key for target in targets])
+
+
+def test_ppa_signing_keys_disk_cache(tmp_dir):
+    """Test that fetched PPA signing keys are reused across executions."""
+    cache_file = join(tmp_dir, '.cache', 'ppa_signing_keys.json')
+    response = launchpad_response('FEED')
+    with patch('yabt.pkgmgmt._SESSION.get',
+               return_value=response) as mock_get:
+        with patch.dict('yabt.pkgmgmt._PPA_SIGNING_KEYS', clear=True):
+            assert ('FEED' ==
+                    get_ppa_signing_key('yabt-test', 'disk', cache_file))
+        assert 1 == mock_get.call_count
+        with open(cache_file, 'r') as cache_f:
+            assert {'yabt-test/disk': 'FEED'} == json.load(cache_f)
+        # simulate a new execution, with nothing in memory
+        with patch.dict('yabt.pkgmgmt._PPA_SIGNING_KEYS', clear=True), \
+                patch('yabt.pkgmgmt._LOADED_PPA_CACHE_FILES', set()):
+            assert ('FEED' ==
+                    get_ppa_signing_key('yabt-test', 'disk', cache_file))
+        assert 1 == mock_get.call_count
+
+
+def test_apt_package_with_repository():
+    """Test that AptPackage repository props are translated to
+       AptRepository props."""
+    target = Target('AptPackage')
+    target.props.package = 'ruby2.4'
+    target.props.version = None
+    target.props.repository = 'ppa:brightbox/ruby-ng'
+    target.props.repo_key = None
+    target.props.repo_keyserver = 'hkp://keyserver.ubuntu.com:80'
+    apt_installable_manipulate_target(None, target)
+    assert {'apt-installable', 'apt-repository'} == target.tags
+    assert {
+        'package': 'ruby2.4',
+        'version': None,
+        'source': 'ppa:brightbox/ruby-ng',
+        'key': None,
+        'keyserver': 'hkp://keyserver.ubuntu.com:80',
+    } == target.props
+
+
+def test_apt_repository_line_cleanup():
+    """Test that comments and extra whitespace are removed from source
+       lines."""
+    target = Target('AptRepository')
+    target.props.source = (
+        '  deb   http://llvm.org/apt/trusty/  llvm-toolchain-trusty-3.9 main '
+        '# LLVM 3.9')
+    target.props.key = None
+    target.props.keyserver = 'hkp://keyserver.ubuntu.com:80'
+    source_line, apt_key_cmd = parse_apt_repository(None, target, DISTRO)
+    assert ('deb http://llvm.org/apt/trusty/ llvm-toolchain-trusty-3.9 main' ==
+            source_line)
+    assert apt_key_cmd is None
+
+
+def test_apt_repository_invalid_line():
+    target = Target('AptRepository')
+    target.props.source = 'deb-src http://llvm.org/apt/trusty/ llvm main'
+    target.props.key = None
+    target.props.keyserver = 'hkp://keyserver.ubuntu.com:80'
+    with pytest.raises(ValueError) as excinfo:
+        parse_apt_repository(None, target, DISTRO)
+    assert 'Invalid source line' in str(excinfo.value)
+
+
+def test_ppa_signing_key_not_found():
+    response = launchpad_response(None, status_code=404)
+    with patch('yabt.pkgmgmt._SESSION.get', return_value=response):
+        with pytest.raises(RuntimeError) as excinfo:
+            get_ppa_signing_key('yabt-test', 'missing')
+    assert ('Failed getting PPA info for ppa:yabt-test/missing' ==
+            str(excinfo.value))
+    response.__exit__.assert_called_once()
@@ -27,8 +27,16 @@ TODO: CppSharedLib builder
 """
 
 
-from hashlib import md5
-from os.path import join, relpath, splitext
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
+import json
+import os
+from os.path import (
+    dirname, isdir, isfile, join, normpath, relpath, samefile, splitext)
+import posixpath
+import re
+from shlex import quote
+from weakref import WeakKeyDictionary
 
 from ostrich.utils.collections import listify
 
@@ -41,10 +49,97 @@ from ..extend import (
     register_cache_json_func)
 from ..logging import make_logger
 from ..target_utils import split, Target
-from ..utils import link_files, rmtree, yprint
+from ..utils import hash_file, link_node, rmtree, yprint
 
 
 logger = make_logger(__name__)
+# Name of the file that lists the files linked into a C++ target workspace
+LINK_MANIFEST_FILE = '.ybt_link_manifest.json'
+# Extension of the files that store the compile key of an object file
+COMPILE_KEY_EXT = '.key'
+# Extension of the dependency files that the compiler writes per object file
+DEPFILE_EXT = '.d'
+_DEPFILE_SPLIT_RE = re.compile(r'(?<!\\)\s+')
+
+
+def as_list(value) -> list:
+    """Return `value` as a list, like `listify`, with a fast path for values
+       that are already lists (the common case on hot paths)."""
+    return value if type(value) is list else listify(value)
+
+
+# Map from build context to a (target graph, map) tuple, of the target graph
+# and a map from target name to the aggregated (extra_compile_flags,
+# extra_link_flags) of all the target dependencies in that graph
+_DEPS_FLAGS_CACHE = WeakKeyDictionary()
+# Map from build context to a map from compiler config JSON to the (shared)
+# compiler config object with that config
+_COMPILER_CONFIGS = WeakKeyDictionary()
+# Map from build context to a map from compiler config inputs (see
+# `CompilerConfig.get_inputs`) to the (shared) compiler config object
+# computed from these inputs
+_COMPILER_CONFIGS_BY_INPUTS = WeakKeyDictionary()
+
+
+def get_deps_flags(build_context, target):
+    """Return a tuple of the extra compile flags & extra link flags collected
+       from the build params of all the dependencies of `target`.
+
+    The result is memoized per build context & target, so targets with the
+    same dependencies don't walk the dependency graph over and over, and
+    recomputed if the target graph is replaced.
+    """
+    graph, deps_flags = _DEPS_FLAGS_CACHE.get(build_context, (None, None))
+    if graph is not build_context.target_graph:
+        deps_flags = {}
+        _DEPS_FLAGS_CACHE[build_context] = (
+            build_context.target_graph, deps_flags)
+    if target.name not in deps_flags:
+        compile_flags, link_flags = [], []
+        # using topological order here because linker `-l<lib>` flags
+        # are sensitive to the order that they appear in!
+        # so if this target depends on, for example, both libsoft and
+        # libfftw, and also libsoft requires symbols that are defined in
+        # libfftw, then `-lfftw` must appear *after* `-lsoft`.
+        for dep in reversed(list(
+                build_context.walk_target_deps_topological_order(target))):
+            build_params = dep.props.build_params
+            compile_flags.extend(
+                as_list(build_params.get('extra_compile_flags')))
+            link_flags.extend(as_list(build_params.get('extra_link_flags')))
+        deps_flags[target.name] = (tuple(compile_flags), tuple(link_flags))
+    return deps_flags[target.name]
+
+
+def dedupe_flags(flags: list) -> list:
+    """Return `flags` without repeated search path & library flags, that are
+       collected multiple times from different dependencies.
+
+    - Search path flags (`-I<dir>` & `-L<dir>`) keep their first occurrence,
+      as the compiler / linker ignores later occurrences anyway.
+    - Library flags (`-l<lib>`) are dropped only when they repeat the
+      previous library flag with no other flag (except search paths) in
+      between, as intentionally repeated library groups (e.g. `-la -lb -la`
+      for mutually dependent static libraries) are order-sensitive.
+    - All other flags are kept as is (they may be order-sensitive, or be
+      arguments of other flags).
+    """
+    seen_paths = set()
+    prev_lib = None
+    deduped = []
+    for flag in flags:
+        if len(flag) > 2 and flag[:2] in ('-I', '-L'):
+            if flag in seen_paths:
+                continue
+            seen_paths.add(flag)
+        elif len(flag) > 2 and flag[:2] == '-l':
+            if flag == prev_lib:
+                continue
+            prev_lib = flag
+        else:
+            prev_lib = None
+        deduped.append(flag)
+    return deduped
 
 
 class CompilerConfig:
@@ -68,60 +163,102 @@ class CompilerConfig:
     TODO: add this note to proper project docs (also - create proper docs...)
     """
 
-    def __init__(self, build_context, target, extra_params=None):
-        self.compiler = self.get(
-            'compiler', build_context.conf, target, 'g++')
-        self.linker = self.get(
-            'linker', build_context.conf, target, 'g++')
+    __slots__ = (
+        'compiler',
+        'linker',
+        'compile_flags',
+        'link_flags',
+        'include_path',
+        'use_fdebug_prefix_map_flag',
+        'use_ccache',
+        'digest',
+    )
+
+    # Target props that the compiler config is computed from
+    TARGET_PARAMS = (
+        'compiler',
+        'linker',
+        'compile_flags',
+        'link_flags',
+        'include_path',
+    )
+
+    def __init__(self, build_context, target, extra_params=None,
+                 inputs: tuple=None):
+        """Compute the compiler config of `target` from its `inputs` (see
+           `get_inputs`), computing them if not given."""
+        if inputs is None:
+            inputs = self.get_inputs(build_context, target, extra_params)
+        (target_params, extra_compile_flags, extra_link_flags,
+         (deps_compile_flags, deps_link_flags)) = inputs
+        target_vals = dict(zip(self.TARGET_PARAMS, target_params))
+        conf = build_context.conf
+        self.compiler = self.get('compiler', conf, target_vals, 'g++')
+        self.linker = self.get('linker', conf, target_vals, 'g++')
         self.compile_flags = list(self.get(
-            'compile_flags', build_context.conf, target, []))
-        self.link_flags = list(self.get(
-            'link_flags', build_context.conf, target, []))
+            'compile_flags', conf, target_vals, []))
+        self.link_flags = list(self.get('link_flags', conf, target_vals, []))
         self.include_path = list(self.get(
-            'include_path', build_context.conf, target, []))
-
-        self.use_fdebug_prefix_map_flag = \
-            build_context.conf.use_fdebug_prefix_map_flag
-
-        def generate_extra_params():
-            if extra_params:
-                yield extra_params
-            yield target.props.build_params
-            # using topological order here because linker `-l<lib>` flags
-            # are sensitive to the order that they appear in!
-            # so if this target depends on, for example, both libsoft and
-            # libfftw, and also libsoft requires symbols that are defined in
-            # libfftw, then `-lfftw` must appear *after* `-lsoft`.
-            yield from (
-                dep.props.build_params for dep in
-                build_context.walk_target_deps_topological_order(target))
-
-        for build_params in reversed(list(generate_extra_params())):
-            self.compile_flags.extend(
-                listify(build_params.get('extra_compile_flags')))
-            self.link_flags.extend(
-                listify(build_params.get('extra_link_flags')))
+            'include_path', conf, target_vals, []))
+
+        self.use_fdebug_prefix_map_flag = conf.use_fdebug_prefix_map_flag
+        self.use_ccache = conf.use_ccache
+
+        self.compile_flags.extend(deps_compile_flags)
+        self.link_flags.extend(deps_link_flags)
+        self.compile_flags.extend(extra_compile_flags)
+        self.link_flags.extend(extra_link_flags)
+        self.compile_flags = dedupe_flags(self.compile_flags)
+        self.link_flags = dedupe_flags(self.link_flags)
+
+    @classmethod
+    def get_inputs(cls, build_context, target, extra_params=None) -> tuple:
+        """Return a hashable tuple of the target-specific inputs that the
+           compiler config of `target` is computed from (with the
+           `extra_params` of its builder).
+
+        Targets with equal inputs (in the same build context) have equal
+        compiler configs, so it can be computed once per unique inputs.
+        """
+        props = target.props
+        # falsy target props fall back to the project config (see `get`)
+        target_params = tuple(
+            (tuple(value) if isinstance(value, list) else value) or None
+            for value in (props.get(param) for param in cls.TARGET_PARAMS))
+        extra_compile_flags, extra_link_flags = [], []
+        for build_params in (props.build_params, extra_params):
+            if build_params:
+                extra_compile_flags.extend(
+                    as_list(build_params.get('extra_compile_flags')))
+                extra_link_flags.extend(
+                    as_list(build_params.get('extra_link_flags')))
+        return (target_params, tuple(extra_compile_flags),
+                tuple(extra_link_flags), get_deps_flags(build_context, target))
 
     def as_dict(self):
-        return {key: getattr(self, key)
-                for key in ('compiler', 'linker', 'compile_flags',
-                            'link_flags', 'include_path')}
-
-    def get(self, param, config, target, fallback):
+        return {
+            'compiler': self.compiler,
+            'linker': self.linker,
+            'compile_flags': self.compile_flags,
+            'link_flags': self.link_flags,
+            'include_path': self.include_path,
+        }
+
+    def get(self, param, config, target_vals: dict, fallback):
         """Return the value of `param`, according to priority / expansion.
 
-        First priority - the target itself.
+        First priority - the target itself (its value in `target_vals`).
         Second priority - the project config.
         Third priority - a global default ("fallback").
 
         In list-params, a '$*' term processed as "expansion term", meaning
         it is replaced with all terms from the config-level.
         """
-        target_val = target.props.get(param)
+        target_val = target_vals.get(param)
         config_val = config.get(param, fallback)
         if not target_val:
             return config_val
-        if isinstance(target_val, list):
+        if isinstance(target_val, (list, tuple)):
             val = []
             for el in target_val:
                 if el == '$*':
@@ -132,22 +269,29 @@ class CompilerConfig:
         return target_val
 
 
-# Common C++ builder signature terms
-CPP_SIG = [
-     ('sources', PT.FileList),
-     ('in_buildenv', PT.Target),
-     ('headers', PT.FileList, None),
-     ('protos', PT.TargetList, None),
-     ('cmd_env', None),
-     ('compiler', PT.str, None),
-     ('linker', PT.str, None),
-     ('compile_flags', PT.StrList, None),
-     ('link_flags', PT.StrList, None),
-     ('include_path', PT.StrList, None),
-     # an internal "prop" used internally bt YBT to add compiler config data
-     # to the target props, so it is considered by target hashing (for cache)
-     ('_internal_dict_', PT.dict, None),
-]
+# Common C++ builder signature terms (a tuple, so it is not mutated by
+# accident when extended)
+CPP_SIG = (
+    ('sources', PT.FileList),
+    ('in_buildenv', PT.Target),
+    ('headers', PT.FileList, None),
+    ('protos', PT.TargetList, None),
+    ('cmd_env', None),
+    ('compiler', PT.str, None),
+    ('linker', PT.str, None),
+    ('compile_flags', PT.StrList, None),
+    ('link_flags', PT.StrList, None),
+    ('include_path', PT.StrList, None),
+    # an internal "prop" used internally bt YBT to add compiler config data
+    # to the target props, so it is considered by target hashing (for cache)
+    ('_internal_dict_', PT.dict, None),
+)
+CPP_GTEST_SIG = CPP_SIG + (
+    ('test_flags', PT.StrList, None),  # flags to append to test command
+    ('test_env', None),  # env vars to inject in test process
+    # TODO: support different testenv image for test execution
+    # ('in_testenv', PT.Target, None),
+)
 
 
 register_app_builder_sig(
@@ -182,7 +326,7 @@ def cpp_app_builder(build_context, target):
         entrypoint = [target.props.executable]
     elif target.props.main:
         prog = build_context.targets[target.props.main]
-        binary = list(prog.artifacts.get(AT.binary).keys())[0]
+        binary = next(iter(prog.artifacts.get(AT.binary)))
         entrypoint = ['/usr/src/bin/' + binary]
     else:
         raise KeyError('Must specify either `main` or `executable` argument')
@@ -191,30 +335,45 @@ def cpp_app_builder(build_context, target):
 
 
 register_builder_sig('CppProg', CPP_SIG)
-register_builder_sig(
-    'CppGTest',
-    CPP_SIG + [
-        ('test_flags', PT.StrList, None),  # flags to append to test command
-        ('test_env', None),  # env vars to inject in test process
-        # TODO: support different testenv image for test execution
-        # ('in_testenv', PT.Target, None),
-    ]
-)
+register_builder_sig('CppGTest', CPP_GTEST_SIG)
+
+
+def intern_compiler_config(build_context, compiler_config):
+    """Return a compiler config equal to `compiler_config`, that is shared by
+       all the targets in `build_context` with an equal compiler config.
+
+    Compiler configs are treated as immutable once they are interned, and
+    have a `digest` attribute - the hash of the config, computed once per
+    unique config.
+    """
+    key = json.dumps(compiler_config.as_dict(), sort_keys=True)
+    configs = _COMPILER_CONFIGS.setdefault(build_context, {})
+    if key not in configs:
+        compiler_config.digest = calc_hash(key)
+        configs[key] = compiler_config
+    return configs[key]
 
 
 def make_pre_build_hook(extra_compiler_config_params):
     """Return a pre-build hook function for C++ builders.
 
     When called, during graph build, it computes and stores the compiler-config
-    object on the target, as well as adding it to the internal_dict prop for
-    hashing purposes.
+    object on the target, as well as adding its digest to the internal_dict
+    prop for hashing purposes.
     """
 
     def pre_build_hook(build_context, target):
-        target.compiler_config = CompilerConfig(
+        configs = _COMPILER_CONFIGS_BY_INPUTS.setdefault(build_context, {})
+        inputs = CompilerConfig.get_inputs(
             build_context, target, extra_compiler_config_params)
-        target.props._internal_dict_['compiler_config'] = (
-            target.compiler_config.as_dict())
+        if inputs not in configs:
+            configs[inputs] = intern_compiler_config(
+                build_context,
+                CompilerConfig(build_context, target,
+                               extra_compiler_config_params, inputs))
+        target.compiler_config = configs[inputs]
+        target.props._internal_dict_['compiler_config_hash'] = (
+            target.compiler_config.digest)
 
     return pre_build_hook
 
@@ -232,52 +391,224 @@ def cpp_gtest_manipulate_target(build_context, target):
     # target.buildenvs.append(target.props.in_testenv)
     # manipulate the test_flags prop during target extraction (as opposed to
     # during build func), so it is considered during target hashing (for cache)
-    target.props.test_flags.extend(listify(
+    target.props.test_flags.extend(as_list(
         build_context.conf.get('gtest_params', {}).get('extra_exec_flags')))
     target.pre_build_hook = make_pre_build_hook(
         build_context.conf.get('gtest_params', {}))
 
 
+CC_EXTENSIONS = frozenset(('cc', 'cpp', 'cxx', 'c++'))
+H_EXTENSIONS = frozenset(('h', 'hpp', 'hh', 'hxx'))
+
+
+def get_extension(filename: str) -> str:
+    """Return the lower-cased extension of `filename` (without the dot), or
+       an empty string if it has no extension."""
+    base, dot, ext = filename.rpartition('.')
+    if not dot or '/' in ext or base.endswith('/') or not base:
+        return ''
+    return ext.lower()
+
+
 def is_cc_file(filename: str) -> bool:
-    return splitext(filename)[-1].lower() in ('.cc', '.cpp', '.cxx', '.c++')
+    return get_extension(filename) in CC_EXTENSIONS
 
 
 def is_h_file(filename: str) -> bool:
-    return splitext(filename)[-1].lower() in ('.h', '.hpp', '.hh', '.hxx')
+    return get_extension(filename) in H_EXTENSIONS
+
+
+def parse_depfile(depfile: str) -> list:
+    """Return the list of dependencies in a make-syntax `depfile` (as written
+       by the compiler with `-MMD -MF`), or None if it doesn't exist."""
+    try:
+        with open(depfile, 'r') as dep_file:
+            content = dep_file.read()
+    except FileNotFoundError:
+        return None
+    # drop the "target:" part & line continuations, and split on whitespace
+    # that is not escaped (escaped whitespace is part of a file name)
+    deps = content.replace('\\\n', ' ').partition(': ')[2]
+    return [dep.replace('\\ ', ' ')
+            for dep in _DEPFILE_SPLIT_RE.split(deps.strip()) if dep]
+
+
+def calc_compile_key(base_key: str, obj_file: str, project_root: str,
+                     buildenv_project_root: str, file_hashes: dict) -> str:
+    """Return the compile key of the object file `obj_file` (on the host).
+
+    The key combines `base_key` with the hashes of all the files that the
+    object was compiled from, according to its depfile. Files from the
+    project (mounted in the buildenv at `buildenv_project_root`) are hashed
+    by content (memoized in `file_hashes`), and other files (from the
+    buildenv image) by path.
+
+    Return None if the depfile, or a project file listed in it, is missing.
+    """
+    deps = parse_depfile(obj_file + DEPFILE_EXT)
+    if deps is None:
+        return None
+    prefix = posixpath.join(posixpath.normpath(buildenv_project_root), '')
+    m = blake2b(digest_size=16)
+    m.update(base_key.encode('utf8'))
+    for dep in deps:
+        m.update(dep.encode('utf8'))
+        if dep.startswith(prefix):
+            host_dep = join(project_root, dep[len(prefix):])
+            if host_dep not in file_hashes:
+                try:
+                    file_hashes[host_dep] = hash_file(host_dep)
+                except FileNotFoundError:
+                    return None
+            m.update(file_hashes[host_dep].encode('utf8'))
+    return m.hexdigest()
+
+
+def is_compiled(obj_file: str, compile_key: str) -> bool:
+    """Return True if `obj_file` exists, and was compiled with `compile_key`
+       (according to its key file)."""
+    if compile_key is None:
+        return False
+    try:
+        with open(obj_file + COMPILE_KEY_EXT, 'r') as key_file:
+            return key_file.read() == compile_key and isfile(obj_file)
+    except FileNotFoundError:
+        return False
 
 
 def compile_cc(build_context, compiler_config, buildenv, sources,
                workspace_dir, buildenv_workspace, cmd_env):
     """Compile list of C++ source files in a buildenv image
        and return list of generated object file.
+
+    The compile commands are written to shell scripts in the workspace, that
+    are executed in buildenv containers - a single one, or one more per idle
+    build job slot, in parallel (instead of a container per source file).
+
+    Sources whose object file was already compiled in the workspace with the
+    same compile key (hash of the command, environment, buildenv, and the
+    source & headers listed in the object depfile) are not compiled again.
     """
     objects = []
+    compile_cmds = []
+    # compile every source once, even if it is listed more than once (so no
+    # two concurrent batches write the same object file)
+    sources = list(dict.fromkeys(sources))
+    # flags that are the same for all the sources
+    common_flags = list(compiler_config.compile_flags)
+    common_flags.extend(
+        '-I' + path
+        for path in [buildenv_workspace] + compiler_config.include_path)
+    if compiler_config.use_fdebug_prefix_map_flag:
+        # Store relative paths (instead of absolute) in debugger symbols
+        # when in debug mode (with gcc and clang, it is harmless otherwise)
+        common_flags.append('-fdebug-prefix-map=%s=.' % buildenv_workspace)
+    rel_workspace_dir = relpath(workspace_dir, build_context.conf.project_root)
+    compiler = [compiler_config.compiler]
+    if compiler_config.use_ccache:
+        # ccache dir is under the project, so it persists across containers
+        compiler.insert(0, 'ccache')
+        conf = build_context.conf
+        cmd_env = dict(cmd_env or {})
+        cmd_env.setdefault(
+            'CCACHE_DIR', conf.host_to_buildenv_path(conf.get_ccache_dir()))
+        # compilers are reinstalled with the buildenv images, so identify
+        # them by content (and not by mtime)
+        cmd_env.setdefault('CCACHE_COMPILERCHECK', 'content')
+    buildenv_hash = build_context.targets[buildenv].hash(build_context)
+    project_root = build_context.conf.project_root
+    buildenv_project_root = build_context.conf.host_to_buildenv_path(
+        project_root)
+    # map from object file (on the host) to the base of its compile key
+    base_keys = {}
+    file_hashes = {}
     for src in sources:
         obj_rel_path = '{}.o'.format(splitext(src)[0])
-        obj_file = join(buildenv_workspace, obj_rel_path)
-        include_paths = [buildenv_workspace] + compiler_config.include_path
-        special_flags = []
-        if compiler_config.use_fdebug_prefix_map_flag:
-            # Store relative paths (instead of absolute) in debugger symbols
-            # when in debug mode (with gcc and clang, it is harmless otherwise)
-            special_flags.extend(['-fdebug-prefix-map=%s=.' %
-                                  buildenv_workspace])
-
-        compile_cmd = (
-            [compiler_config.compiler, '-o', obj_file, '-c'] +
-            compiler_config.compile_flags +
-            ['-I{}'.format(path) for path in include_paths] +
-            special_flags +
-            [join(buildenv_workspace, src)])
-        # TODO: capture and transform error messages from compiler so file
-        # paths match host paths for smooth(er) editor / IDE integration
-        build_context.run_in_buildenv(buildenv, compile_cmd, cmd_env)
-        objects.append(
-            join(relpath(workspace_dir, build_context.conf.project_root),
-                 obj_rel_path))
+        # buildenv paths are POSIX paths, and the source paths are relative
+        # to the workspace, so no need for `join` here
+        obj_file = f'{buildenv_workspace}/{obj_rel_path}'
+        compile_cmd = compiler + [
+            '-o', obj_file, '-MMD', '-MF', obj_file + DEPFILE_EXT, '-c']
+        compile_cmd.extend(common_flags)
+        compile_cmd.append(f'{buildenv_workspace}/{src}')
+        objects.append(join(rel_workspace_dir, obj_rel_path))
+        host_obj_file = join(workspace_dir, obj_rel_path)
+        base_key = calc_dict_hash({
+            'cmd': compile_cmd,
+            'env': cmd_env,
+            'buildenv': buildenv_hash,
+        })
+        if is_compiled(host_obj_file, calc_compile_key(
+                base_key, host_obj_file, project_root, buildenv_project_root,
+                file_hashes)):
+            logger.debug('Object {} is up to date', obj_rel_path)
+            continue
+        compile_cmds.append(compile_cmd)
+        base_keys[host_obj_file] = base_key
+    # remove stale keys before compiling, so objects that are overwritten by
+    # a failing build are not considered up to date by the next build
+    for host_obj_file in base_keys:
+        try:
+            os.remove(host_obj_file + COMPILE_KEY_EXT)
+        except FileNotFoundError:
+            pass
+    # split the compile commands into round-robin batches, each executed by
+    # its own buildenv container, concurrently - one batch in the job slot of
+    # this target build, and one per idle build job slot (so the build as a
+    # whole doesn't run more than `jobs` containers at once)
+    extra_jobs = build_context.acquire_extra_jobs(len(compile_cmds) - 1)
+    try:
+        num_batches = min(1 + extra_jobs, len(compile_cmds))
+        if num_batches == 1:
+            script_names = ['compile.sh']
+        else:
+            script_names = ['compile.{}.sh'.format(batch_idx)
+                            for batch_idx in range(num_batches)]
+
+        def compile_batch(batch_idx):
+            # TODO: capture and transform error messages from compiler so file
+            # paths match host paths for smooth(er) editor / IDE integration
+            run_script_in_buildenv(
+                build_context, buildenv, compile_cmds[batch_idx::num_batches],
+                workspace_dir, buildenv_workspace, cmd_env,
+                script_names[batch_idx])
+
+        if num_batches == 1:
+            compile_batch(0)
+        elif num_batches > 1:
+            with ThreadPoolExecutor(max_workers=num_batches) as executor:
+                # consume the results, so failures are raised here
+                list(executor.map(compile_batch, range(num_batches)))
+    finally:
+        build_context.release_extra_jobs(extra_jobs)
+    for host_obj_file, base_key in base_keys.items():
+        compile_key = calc_compile_key(
+            base_key, host_obj_file, project_root, buildenv_project_root,
+            file_hashes)
+        if compile_key:
+            with open(host_obj_file + COMPILE_KEY_EXT, 'w') as key_file:
+                key_file.write(compile_key)
     return objects
 
 
+def run_script_in_buildenv(build_context, buildenv, cmds, workspace_dir,
+                           buildenv_workspace, cmd_env,
+                           script_name: str='compile.sh'):
+    """Run list of commands as a shell script in a single buildenv container,
+       stopping on the first failing command.
+
+    The script is written to `workspace_dir` on the host, and executed from
+    `buildenv_workspace` (the same dir, as seen inside the buildenv).
+    """
+    with open(join(workspace_dir, script_name), 'w') as script_file:
+        script_file.write('set -e\n')
+        for cmd in cmds:
+            script_file.write(' '.join(quote(part) for part in cmd))
+            script_file.write('\n')
+    build_context.run_in_buildenv(
+        buildenv, ['sh', join(buildenv_workspace, script_name)], cmd_env)
+
+
 def link_cpp_artifacts(build_context, target, workspace_dir,
                        include_objects: bool):
     """Link required artifacts from dependencies under target workspace dir.
@@ -289,61 +620,218 @@ def link_cpp_artifacts(build_context, target, workspace_dir,
     - Generated header files from all dependencies
     - If `include_objects` is True, also object files from all dependencies
       (these will be returned without linking)
+
+    Only workspace files that changed since the previous call (according to
+    its link manifest) are re-linked, and files that are no longer needed are
+    removed, so other workspace files (such as objects) are kept. Directories
+    are re-linked only if their members changed (according to the member
+    list & mtimes in the manifest). Workspaces without a link manifest are
+    cleaned and linked from scratch.
     """
+    # map from workspace file path to the source file path that is linked to
+    # it (both relative, to workspace & project root, respectively).
     # include the source & header files of the current target
     # add objects of all dependencies (direct & transitive), if needed
-    source_files = target.props.sources + target.props.headers
+    workspace_files = {normpath(src): src for src in
+                       target.props.sources + target.props.headers}
+    gen_h_files = {}
     objects = []
 
-    # add headers of dependencies
+    # add headers & generated headers, and collect objects of dependencies
+    # (in a single walk over the dependencies)
     for dep in build_context.generate_all_deps(target):
-        source_files.extend(dep.props.get('headers', []))
-
-    link_files(source_files, workspace_dir, None, build_context.conf)
-
-    # add generated headers and collect objects of dependencies
-    for dep in build_context.generate_all_deps(target):
-        dep.artifacts.link_types(workspace_dir, [AT.gen_h], build_context.conf)
+        workspace_files.update(
+            (normpath(src), src) for src in dep.props.get('headers', []))
+        gen_h_files.update(
+            (join(dep.artifacts.type_to_dir[AT.gen_h], dst), src)
+            for dst, src in dep.artifacts.get_all().get(AT.gen_h, {}).items())
         if include_objects:
             objects.extend(dep.artifacts.get(AT.object).values())
+    # generated headers are linked after (override) the source files
+    workspace_files.update(gen_h_files)
 
     # add generated code from proto dependencies
     for proto_dep_name in target.props.protos:
         proto_dep = build_context.targets[proto_dep_name]
-        proto_dep.artifacts.link_types(workspace_dir, [AT.gen_cc],
-                                       build_context.conf)
-
+        workspace_files.update(
+            (join(proto_dep.artifacts.type_to_dir[AT.gen_cc], dst), src)
+            for dst, src in
+            proto_dep.artifacts.get_all().get(AT.gen_cc, {}).items())
+
+    project_root = build_context.conf.project_root
+    linked_files = read_link_manifest(workspace_dir)
+    if linked_files is None:
+        # unknown workspace content - start from a clean workspace
+        rmtree(workspace_dir)
+        os.makedirs(workspace_dir)
+        linked_files = {}
+    # map from workspace directory path to the members of the source
+    # directory that is linked to it (see `get_dir_members`)
+    dir_members = {
+        dst: get_dir_members(join(project_root, src))
+        for dst, src in workspace_files.items()
+        if isdir(join(project_root, src))}
+
+    def is_linked(dst, src):
+        abs_dst = join(workspace_dir, dst)
+        if dst in dir_members:
+            # directories are copied trees of hard links, so they are linked
+            # if none of the source directory members changed since
+            return (linked_files.get(dst) == (src, dir_members[dst]) and
+                    isdir(abs_dst))
+        return (linked_files.get(dst, (None, None))[0] == src and
+                is_node_linked(join(project_root, src), abs_dst))
+
+    stale_files = [dst for dst in linked_files if dst not in workspace_files]
+    relink_files = [dst for dst, src in workspace_files.items()
+                    if not is_linked(dst, src)]
+    if not stale_files and not relink_files:
+        logger.debug('Workspace of target {} is already linked',
+                     target.name)
+        return objects
+    # directories are re-linked as a whole, so files under re-linked
+    # directories must be re-linked after them
+    relink_dirs = tuple(dst + os.sep for dst in relink_files
+                        if dst in dir_members)
+    if relink_dirs:
+        relink_files = [dst for dst in workspace_files
+                        if dst in relink_files or dst.startswith(relink_dirs)]
+
+    manifest_path = join(workspace_dir, LINK_MANIFEST_FILE)
+    # the manifest is valid only after all the files are linked
+    remove_node(manifest_path)
+    for dst in stale_files:
+        unlink_node(join(workspace_dir, dst), linked_files[dst][1])
+    created_dirs = {workspace_dir}
+    for dst in relink_files:
+        abs_src = join(project_root, workspace_files[dst])
+        abs_dst = join(workspace_dir, dst)
+        if dst in dir_members:
+            # re-link the directory members in place, so other files under
+            # the workspace directory (such as objects) are kept
+            members = dir_members[dst]
+            if isdir(abs_dst):
+                new_members = {member for member, _ in members}
+                for member, _ in linked_files.get(dst, (None, ()))[1] or ():
+                    if member not in new_members:
+                        remove_node(join(abs_dst, member))
+            else:
+                remove_node(abs_dst)
+            for member, _ in members:
+                link_node(join(abs_src, member), join(abs_dst, member))
+            continue
+        remove_node(abs_dst)
+        dst_dir = dirname(abs_dst)
+        if dst_dir not in created_dirs:
+            os.makedirs(dst_dir, exist_ok=True)
+            created_dirs.add(dst_dir)
+        try:
+            # fast path for files - hard link directly
+            os.link(abs_src, abs_dst)
+        except (FileExistsError, IsADirectoryError, PermissionError):
+            # overlapping paths are handled by `link_node`
+            link_node(abs_src, abs_dst)
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump([(dst, src, dir_members.get(dst))
+                   for dst, src in sorted(workspace_files.items())],
+                  manifest_file)
     return objects
 
 
+def read_link_manifest(workspace_dir: str) -> dict:
+    """Return the map from workspace file to a (source file, directory
+       members) tuple that was linked by the last `link_cpp_artifacts` call
+       to `workspace_dir` (directory members are None for files), or None if
+       there is no valid link manifest."""
+    try:
+        with open(join(workspace_dir, LINK_MANIFEST_FILE), 'r') as f:
+            return {dst: (src, members)
+                    for dst, src, members in json.load(f)}
+    except (FileNotFoundError, ValueError, TypeError):
+        return None
+
+
+def get_dir_members(abs_dir: str) -> list:
+    """Return the sorted list of [path, mtime] pairs of the files under the
+       directory `abs_dir` (paths relative to it, mtimes in nanoseconds),
+       that are linked by `link_node` (so skipping .git directories)."""
+    members = []
+    for dir_path, dir_names, file_names in os.walk(abs_dir):
+        if '.git' in dir_names:
+            dir_names.remove('.git')
+        rel_dir = relpath(dir_path, abs_dir)
+        for file_name in file_names:
+            if file_name == '.git':
+                continue
+            members.append([
+                normpath(join(rel_dir, file_name)),
+                os.stat(join(dir_path, file_name)).st_mtime_ns])
+    members.sort()
+    return members
+
+
+def is_node_linked(abs_src: str, abs_dst: str) -> bool:
+    """Return True if `abs_dst` is a hard link of the file `abs_src`.
+
+    A hard link of the source file has the same content by definition, so
+    it doesn't need to be re-linked.
+    """
+    try:
+        return isfile(abs_src) and samefile(abs_src, abs_dst)
+    except FileNotFoundError:
+        return False
+
+
+def unlink_node(path: str, dir_members: list=None):
+    """Remove the node at `path` that was linked to the workspace - only the
+       files `dir_members` of a linked directory (so other files under it,
+       such as objects, are kept), or the entire node otherwise."""
+    if dir_members is None or not isdir(path):
+        remove_node(path)
+        return
+    for member, _ in dir_members:
+        remove_node(join(path, member))
+
+
+def remove_node(path: str):
+    """Remove the file or directory tree at `path`, if it exists."""
+    if isdir(path) and not os.path.islink(path):
+        rmtree(path)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
 def get_source_files(target, build_context) -> list:
     """Return list of source files for `target`."""
-    all_sources = list(target.props.sources)
-    for proto_dep_name in target.props.protos:
-        proto_dep = build_context.targets[proto_dep_name]
-        all_sources.extend(proto_dep.artifacts.get(AT.gen_cc).keys())
+    props, targets = target.props, build_context.targets
+    all_sources = list(props.sources)
+    for proto_dep_name in props.protos:
+        all_sources.extend(targets[proto_dep_name].artifacts.get(AT.gen_cc))
     return all_sources
 
 
 def build_cpp(build_context, target, compiler_config, workspace_dir):
     """Compile and link a C++ binary for `target`."""
-    rmtree(workspace_dir)
+    conf, props = build_context.conf, target.props
+    in_buildenv, cmd_env = props.in_buildenv, props.cmd_env
     binary = join(*split(target.name))
     objects = link_cpp_artifacts(build_context, target, workspace_dir, True)
-    buildenv_workspace = build_context.conf.host_to_buildenv_path(
-        workspace_dir)
+    buildenv_workspace = conf.host_to_buildenv_path(workspace_dir)
     objects.extend(compile_cc(
-        build_context, compiler_config, target.props.in_buildenv,
+        build_context, compiler_config, in_buildenv,
         get_source_files(target, build_context), workspace_dir,
-        buildenv_workspace, target.props.cmd_env))
+        buildenv_workspace, cmd_env))
     bin_file = join(buildenv_workspace, binary)
+    # dedupe objects (keeping order), so no object is linked twice
     link_cmd = (
         [compiler_config.linker, '-o', bin_file] +
-        objects + compiler_config.link_flags)
-    build_context.run_in_buildenv(
-        target.props.in_buildenv, link_cmd, target.props.cmd_env)
+        list(dict.fromkeys(objects)) + compiler_config.link_flags)
+    build_context.run_in_buildenv(in_buildenv, link_cmd, cmd_env)
     target.artifacts.add(AT.binary, relpath(join(workspace_dir, binary),
-                         build_context.conf.project_root), binary)
+                         conf.project_root), binary)
 
 
 @register_build_func('CppProg')
@@ -405,37 +893,67 @@ def cpp_lib_builder(build_context, target):
     yprint(build_context.conf, 'Build CppLib', target)
     workspace_dir = build_context.get_workspace('CppLib', target.name)
     workspace_src_dir = join(workspace_dir, 'src')
-    rmtree(workspace_src_dir)
     link_cpp_artifacts(build_context, target, workspace_src_dir, False)
+    props = target.props
     buildenv_workspace = build_context.conf.host_to_buildenv_path(
         workspace_src_dir)
     objects = compile_cc(
-        build_context, target.compiler_config, target.props.in_buildenv,
+        build_context, target.compiler_config, props.in_buildenv,
         get_source_files(target, build_context), workspace_src_dir,
-        buildenv_workspace, target.props.cmd_env)
+        buildenv_workspace, props.cmd_env)
     for obj_file in objects:
         target.artifacts.add(AT.object, obj_file)
 
 
 def calc_hash(json_str):
-    m = md5()
+    # BLAKE2b with a 16 bytes digest is faster than MD5, while keeping the
+    # hex digest the same length (these hashes are cache keys, not signatures)
+    m = blake2b(digest_size=16)
     m.update(json_str.encode('utf8'))
     return m.hexdigest()
 
 
-def get_deps_specific_hash(build_context, target, dep_type, hash_name):
-    hashes = []
-    for dep_name in listify(target.deps):
+def calc_dict_hash(json_dict: dict):
+    """Return the hash of a compact JSON serialization of `json_dict`.
+
+    Used for hashes that are never stored as JSON, where the compact
+    serialization (done by the C encoder, unlike indented serialization) is
+    much faster.
+    """
+    return calc_hash(
+        json.dumps(json_dict, sort_keys=True, separators=(',', ':')))
+
+
+def get_deps_specific_hashes(build_context, target, dep_type,
+                             hash_names: tuple):
+    """Return a tuple with a list of dependency hashes per hash name in
+       `hash_names`, collected in a single pass over the target deps.
+
+    Dependencies built by `dep_type` contribute their specific hash
+    (attribute named by the hash name), and all other dependencies
+    contribute their cache hash.
+    """
+    hashes = tuple([] for _ in hash_names)
+    for dep_name in as_list(target.deps):
         dep_target = build_context.targets[dep_name]
         if dep_target.builder_name == dep_type:
-            if not hasattr(dep_target, hash_name):
+            if not all(hasattr(dep_target, hash_name)
+                       for hash_name in hash_names):
                 dep_target.compute_json(build_context)
-            hashes.append(getattr(dep_target, hash_name))
+            for dep_hashes, hash_name in zip(hashes, hash_names):
+                dep_hashes.append(getattr(dep_target, hash_name))
         else:
-            hashes.append(dep_target.hash(build_context))
+            dep_hash = dep_target.hash(build_context)
+            for dep_hashes in hashes:
+                dep_hashes.append(dep_hash)
     return hashes
 
 
+def get_deps_specific_hash(build_context, target, dep_type, hash_name):
+    return get_deps_specific_hashes(
+        build_context, target, dep_type, (hash_name,))[0]
+
+
 @register_cache_json_func('CppLib')
 def cpp_lib_cache_json(build_context, target: Target):
     """
@@ -454,19 +972,16 @@ def cpp_lib_cache_json(build_context, target: Target):
 
     The hash used to access the cache is the sources hash.
     """
-    full_hashes = get_deps_specific_hash(build_context, target, 'CppLib',
-                                         '_full_hash')
-    headers_hashes = get_deps_specific_hash(build_context, target, 'CppLib',
-                                            '_headers_hash')
-    full_json = target.compute_target_json(build_context, [], full_hashes)
-    headers_json = target.compute_target_json(build_context, ['sources'],
-                                              headers_hashes)
-    sources_json = target.compute_target_json(build_context, [],
-                                              headers_hashes)
-
-    target._full_hash = calc_hash(full_json)
-    target._headers_hash = calc_hash(headers_json)
-    return sources_json
+    full_hashes, headers_hashes = get_deps_specific_hashes(
+        build_context, target, 'CppLib', ('_full_hash', '_headers_hash'))
+    # process the props (hashing source & header files) once for all 3 hashes
+    props = target.compute_props(build_context)
+    target._full_hash = calc_dict_hash(target.compute_target_dict(
+        build_context, [], full_hashes, props))
+    target._headers_hash = calc_dict_hash(target.compute_target_dict(
+        build_context, ['sources'], headers_hashes, props))
+    return target.compute_target_json(
+        build_context, [], headers_hashes, props)
 
 
 @register_cache_json_func('CppProg')
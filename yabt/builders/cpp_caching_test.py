@@ -38,6 +38,34 @@ OP_OBJ_FILE = path.join('yabtwork', 'release_flavor', 'CppLib',
                         '_op_user_lib', 'src', 'op_user_lib.o')
 
 
+def link_or_copy(src, dst):
+    """Hard-link `src` to `dst`, falling back to copying across devices."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+@pytest.fixture
+def in_cpp_caching_copy(tmp_dir):
+    """Run in a copy of the cpp_caching project, with its files hard-linked
+       (instead of copied) when possible."""
+    shutil.copytree(PROJECT_DIR, 'cpp_caching', copy_function=link_or_copy)
+    os.chdir('cpp_caching')
+    yield
+
+
+def change_binary_operation():
+    """Change the binary operation from addition to multiplication."""
+    with open('binary_operation.cc', 'r') as f:
+        binary_operation_code = f.read()
+    # unlink first, so the write creates a new file, and doesn't modify the
+    # (possibly hard-linked) project fixture
+    os.remove('binary_operation.cc')
+    with open('binary_operation.cc', 'w') as f:
+        f.write(binary_operation_code.replace('+', '*'))
+
+
 def build_main_app(target_name):
     basic_conf = cli.init_and_get_conf(
         ['--non-interactive', '--continue-after-fail', '--scm-provider',
@@ -59,18 +87,13 @@ def build_test():
 
 
 @pytest.mark.slow
-def test_caching_prog(tmp_dir):
-    shutil.copytree(PROJECT_DIR, 'cpp_caching')
-    os.chdir('cpp_caching')
-
+@pytest.mark.usefixtures('in_cpp_caching_copy')
+def test_caching_prog():
     build_main_app(':main-app')
     op_obj_timestamp = path.getmtime(OP_OBJ_FILE)
     assert check_output(['docker', 'run', 'main-app:latest']) == b'12'
 
-    with open('binary_operation.cc', 'r') as f:
-        binary_operation_code = f.read()
-    with open('binary_operation.cc', 'w') as f:
-        f.write(binary_operation_code.replace('+', '*'))
+    change_binary_operation()
 
     build_main_app(':main-app')
     assert op_obj_timestamp == path.getmtime(OP_OBJ_FILE)
@@ -78,17 +101,12 @@ def test_caching_prog(tmp_dir):
 
 
 @pytest.mark.slow
-def test_caching_gtest(tmp_dir):
-    shutil.copytree(PROJECT_DIR, 'cpp_caching')
-    os.chdir('cpp_caching')
-
+@pytest.mark.usefixtures('in_cpp_caching_copy')
+def test_caching_gtest():
     build_test()
     op_obj_timestamp = path.getmtime(OP_OBJ_FILE)
 
-    with open('binary_operation.cc', 'r') as f:
-        binary_operation_code = f.read()
-    with open('binary_operation.cc', 'w') as f:
-        f.write(binary_operation_code.replace('+', '*'))
+    change_binary_operation()
 
     with pytest.raises(SystemExit):
         build_test()
@@ -96,19 +114,14 @@ def test_caching_gtest(tmp_dir):
 
 
 @pytest.mark.slow
-def test_caching_far_change(tmp_dir):
-    shutil.copytree(PROJECT_DIR, 'cpp_caching')
-    os.chdir('cpp_caching')
-
+@pytest.mark.usefixtures('in_cpp_caching_copy')
+def test_caching_far_change():
     build_main_app(':main_far_change-app')
     op_obj_timestamp = path.getmtime(OP_OBJ_FILE)
     assert check_output(['docker', 'run', 'main_far_change-app:latest']) \
            == b'12'
 
-    with open('binary_operation.cc', 'r') as f:
-        binary_operation_code = f.read()
-    with open('binary_operation.cc', 'w') as f:
-        f.write(binary_operation_code.replace('+', '*'))
+    change_binary_operation()
 
     build_main_app(':main_far_change-app')
     assert op_obj_timestamp == path.getmtime(OP_OBJ_FILE)
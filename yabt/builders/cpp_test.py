@@ -20,17 +20,35 @@
 """
 
 
+import os
 from os.path import join
 import shutil
 from subprocess import check_output
+import threading
+import time
+from unittest.mock import MagicMock, patch
 
 import pytest
 
+from conftest import BASIC_ARGV, DEBUG_ARGV, init_conf
 from . import cpp
 from ..buildcontext import BuildContext
+from ..config import _host_to_buildenv_path
 from ..graph import populate_targets_graph
 
 
+CPP_PROJECT_DIR = join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                       'tests', 'cpp')
+COMPILER_CONFIG_TARGETS = [
+    'compiler_config:defaults',
+    'compiler_config:override-compiler',
+    'compiler_config:override-flags',
+    'compiler_config:post-extend-flags',
+    'compiler_config:pre-extend-flags',
+    'compiler_config:dep-extend-flags',
+]
+
+
 def clear_bin():
     try:
         shutil.rmtree('ybt_bin')
@@ -38,7 +56,31 @@ def clear_bin():
         pass
 
 
-@pytest.mark.usefixtures('in_cpp_project')
+def populated_cpp_context(argv: list):
+    """Yield a build context of the C++ test project, populated with all the
+       compiler config test targets (once, instead of once per test case)."""
+    orig_dir = os.getcwd()
+    os.chdir(CPP_PROJECT_DIR)
+    try:
+        conf = init_conf(argv)
+        build_context = BuildContext(conf)
+        conf.targets = COMPILER_CONFIG_TARGETS
+        populate_targets_graph(build_context, conf)
+    finally:
+        os.chdir(orig_dir)
+    yield build_context
+
+
+@pytest.fixture(scope='module')
+def compiler_config_context():
+    yield from populated_cpp_context(BASIC_ARGV)
+
+
+@pytest.fixture(scope='module')
+def compiler_config_debug_context():
+    yield from populated_cpp_context(DEBUG_ARGV)
+
+
 @pytest.mark.parametrize(
     'test_case',
     (
@@ -59,11 +101,9 @@ def clear_bin():
          ['-std=c++14', '-Wall', '-fcolor-diagnostics',
           '-O2', '-DDEBUG', '-DFOO=BAR'], ['-lfoo']),
     ))
-def test_compiler_config(basic_conf, test_case):
+def test_compiler_config(compiler_config_context, test_case):
     target_name, exp_compiler, exp_compile_flags, exp_link_flags = test_case
-    build_context = BuildContext(basic_conf)
-    basic_conf.targets = [target_name]
-    populate_targets_graph(build_context, basic_conf)
+    build_context = compiler_config_context
     target = build_context.targets[target_name]
     cc = cpp.CompilerConfig(build_context, target)
     assert cc.compiler == exp_compiler
@@ -71,11 +111,358 @@ def test_compiler_config(basic_conf, test_case):
     assert cc.link_flags == exp_link_flags
     # also check flavored workspace dir
     assert (build_context.get_workspace('foo', 'bar:baz') ==
-            join(basic_conf.project_root,
+            join(build_context.conf.project_root,
                  'yabtwork', 'release_flavor', 'foo', 'bar_baz'))
 
 
 @pytest.mark.usefixtures('in_cpp_project')
+def test_deps_flags_memoized(basic_conf):
+    build_context = BuildContext(basic_conf)
+    target_name = 'compiler_config:dep-extend-flags'
+    basic_conf.targets = [target_name]
+    populate_targets_graph(build_context, basic_conf)
+    target = build_context.targets[target_name]
+    deps_flags = cpp.get_deps_flags(build_context, target)
+    assert deps_flags == (('-DFOO=BAR',), ('-lfoo',))
+    assert cpp.get_deps_flags(build_context, target) is deps_flags
+    # replacing the target graph invalidates the memoized flags
+    build_context.target_graph = build_context.target_graph.subgraph(
+        [target_name]).copy()
+    assert cpp.get_deps_flags(build_context, target) == ((), ())
+
+
+def test_link_cpp_artifacts_relinks_only_changes(tmp_dir):
+    os.makedirs(join('inc', 'sub'))
+    for src in ('a.cc', 'a.h', 'b.h', join('inc', 'sub', 'c.h')):
+        with open(src, 'w') as src_file:
+            src_file.write(src)
+    build_context = MagicMock()
+    build_context.conf.project_root = tmp_dir
+    build_context.generate_all_deps.return_value = []
+    target = MagicMock()
+    target.props.sources = ['a.cc']
+    target.props.headers = ['a.h']
+    target.props.protos = []
+    workspace_dir = join(tmp_dir, 'ws')
+
+    def link():
+        cpp.link_cpp_artifacts(build_context, target, workspace_dir, False)
+        return sorted(os.listdir(workspace_dir))
+
+    manifest = cpp.LINK_MANIFEST_FILE
+    assert sorted(['a.cc', 'a.h', manifest]) == link()
+    # unchanged workspace is not cleaned
+    with open(join(workspace_dir, 'a.o'), 'w'):
+        pass
+    assert sorted(['a.cc', 'a.h', 'a.o', manifest]) == link()
+    # replaced source file (not a hard link anymore) is re-linked, keeping
+    # the rest of the workspace
+    os.remove('a.h')
+    with open('a.h', 'w') as src_file:
+        src_file.write('changed')
+    assert sorted(['a.cc', 'a.h', 'a.o', manifest]) == link()
+    with open(join(workspace_dir, 'a.h')) as ws_file:
+        assert 'changed' == ws_file.read()
+    # files that are no longer needed are removed
+    target.props.headers = ['b.h', 'inc']
+    assert sorted(['a.cc', 'a.o', 'b.h', 'inc', manifest]) == link()
+    assert os.path.samefile(join('inc', 'sub', 'c.h'),
+                            join(workspace_dir, 'inc', 'sub', 'c.h'))
+    # unchanged directories are not re-linked
+    ws_obj = join(workspace_dir, 'inc', 'sub', 'c.o')
+    with open(ws_obj, 'w'):
+        pass
+    with patch.object(cpp, 'link_node') as link_node:
+        assert sorted(['a.cc', 'a.o', 'b.h', 'inc', manifest]) == link()
+    link_node.assert_not_called()
+    # changed directories are re-linked in place, keeping other files
+    with open(join('inc', 'd.h'), 'w'):
+        pass
+    link()
+    assert os.path.samefile(join('inc', 'd.h'),
+                            join(workspace_dir, 'inc', 'd.h'))
+    assert os.path.isfile(ws_obj)
+    os.remove(join('inc', 'd.h'))
+    link()
+    assert not os.path.exists(join(workspace_dir, 'inc', 'd.h'))
+    assert os.path.isfile(ws_obj)
+    # directories that are no longer needed are unlinked, keeping other files
+    target.props.headers = ['b.h']
+    link()
+    assert ['c.o'] == os.listdir(join(workspace_dir, 'inc', 'sub'))
+    # workspaces without a link manifest are linked from scratch
+    target.props.headers = ['b.h', 'inc']
+    os.remove(join(workspace_dir, manifest))
+    assert sorted(['a.cc', 'b.h', 'inc', manifest]) == link()
+
+
+@pytest.mark.parametrize(
+    'filename, is_cc, is_h',
+    (
+        ('foo.cc', True, False),
+        ('foo/bar.CPP', True, False),
+        ('foo.c++', True, False),
+        ('foo.h', False, True),
+        ('foo/bar.hxx', False, True),
+        ('foo.c', False, False),
+        ('foo.cc/bar', False, False),
+        ('foo/.cc', False, False),
+        ('cc', False, False),
+    ))
+def test_source_file_types(filename, is_cc, is_h):
+    assert is_cc == cpp.is_cc_file(filename)
+    assert is_h == cpp.is_h_file(filename)
+
+
+def test_dedupe_flags():
+    assert ['-Ifoo', '-DX', '-Ibar', '-DX', '-include', 'x.h', '-include',
+            'x.h'] == cpp.dedupe_flags(
+        ['-Ifoo', '-DX', '-Ibar', '-Ifoo', '-DX', '-include', 'x.h',
+         '-include', 'x.h'])
+    assert ['-Lfoo', '-lfoo', '-lbar', '-lbaz'] == cpp.dedupe_flags(
+        ['-Lfoo', '-lfoo', '-lfoo', '-lbar', '-Lfoo', '-lbar', '-lbaz'])
+
+
+def test_dedupe_flags_keeps_repeated_lib_groups():
+    # mutually dependent static libraries are intentionally repeated
+    assert ['-la', '-lb', '-la', '-lb'] == cpp.dedupe_flags(
+        ['-la', '-lb', '-la', '-lb'])
+    assert ['-la', '-Wl,--as-needed', '-la'] == cpp.dedupe_flags(
+        ['-la', '-Wl,--as-needed', '-la'])
+
+
+def mock_compile_context(tmp_dir, sources, jobs: int=1):
+    """Return a mock build context for compiling `sources` (that are created
+       in `tmp_dir`), in a build of `jobs` job slots (where the compiling
+       target build holds one of them)."""
+    for src in sources:
+        with open(join(tmp_dir, src), 'w') as src_file:
+            src_file.write(src)
+    build_context = MagicMock()
+    build_context.conf.project_root = tmp_dir
+    build_context.conf.jobs = jobs
+    build_context.conf.host_to_buildenv_path.side_effect = (
+        lambda path: _host_to_buildenv_path(os.path.abspath(path), tmp_dir))
+    build_context._job_slots = threading.Semaphore(jobs - 1)
+    for method in ('acquire_extra_jobs', 'release_extra_jobs'):
+        setattr(build_context, method, getattr(BuildContext, method).__get__(
+            build_context))
+    build_context.targets[':builder'].hash.return_value = 'buildenv-hash'
+    return build_context
+
+
+def test_compile_cc_single_buildenv_run(tmp_dir):
+    build_context = mock_compile_context(tmp_dir, ['a.cc', 'b c.cc'])
+    compiler_config = MagicMock(
+        compiler='g++', compile_flags=['-O2'], include_path=[],
+        use_fdebug_prefix_map_flag=False, use_ccache=False)
+    objects = cpp.compile_cc(
+        build_context, compiler_config, ':builder', ['a.cc', 'b c.cc'],
+        tmp_dir, '/project', None)
+    assert ['./a.o', './b c.o'] == objects
+    build_context.run_in_buildenv.assert_called_once_with(
+        ':builder', ['sh', '/project/compile.sh'], None)
+    with open(join(tmp_dir, 'compile.sh')) as script_file:
+        assert [
+            'set -e',
+            'g++ -o /project/a.o -MMD -MF /project/a.o.d -c -O2 -I/project '
+            '/project/a.cc',
+            "g++ -o '/project/b c.o' -MMD -MF '/project/b c.o.d' -c -O2 "
+            "-I/project '/project/b c.cc'",
+        ] == script_file.read().splitlines()
+
+
+def test_compile_cc_ccache(tmp_dir):
+    build_context = mock_compile_context(tmp_dir, ['a.cc'])
+    build_context.conf.get_ccache_dir.return_value = join(tmp_dir, 'ccache')
+    compiler_config = MagicMock(
+        compiler='g++', compile_flags=[], include_path=[],
+        use_fdebug_prefix_map_flag=False, use_ccache=True)
+    cpp.compile_cc(build_context, compiler_config, ':builder', ['a.cc'],
+                   tmp_dir, '/project', {'FOO': 'bar'})
+    build_context.run_in_buildenv.assert_called_once_with(
+        ':builder', ['sh', '/project/compile.sh'],
+        {'FOO': 'bar', 'CCACHE_DIR': '/project/ccache',
+         'CCACHE_COMPILERCHECK': 'content'})
+    with open(join(tmp_dir, 'compile.sh')) as script_file:
+        assert ('ccache g++ -o /project/a.o -MMD -MF /project/a.o.d -c '
+                '-I/project /project/a.cc' ==
+                script_file.read().splitlines()[1])
+
+
+def test_compile_cc_parallel_batches(tmp_dir):
+    build_context = mock_compile_context(
+        tmp_dir, ['a.cc', 'b.cc', 'c.cc'], jobs=2)
+    compiler_config = MagicMock(
+        compiler='g++', compile_flags=[], include_path=[],
+        use_fdebug_prefix_map_flag=False, use_ccache=False)
+    objects = cpp.compile_cc(
+        build_context, compiler_config, ':builder',
+        ['a.cc', 'b.cc', 'c.cc', 'a.cc'], tmp_dir, '/project', None)
+    assert ['./a.o', './b.o', './c.o'] == objects
+    assert 2 == build_context.run_in_buildenv.call_count
+    for script_name, srcs in (('compile.0.sh', 'ac'), ('compile.1.sh', 'b')):
+        with open(join(tmp_dir, script_name)) as script_file:
+            assert ['set -e'] + [
+                'g++ -o /project/{0}.o -MMD -MF /project/{0}.o.d -c '
+                '-I/project /project/{0}.cc'.format(src) for src in srcs
+            ] == script_file.read().splitlines()
+
+
+def test_compile_cc_batches_share_build_jobs(tmp_dir):
+    sources = ['{}.cc'.format(src) for src in 'abcdef']
+    build_context = mock_compile_context(tmp_dir, sources, jobs=4)
+    # another target build is holding one of the idle job slots
+    build_context.acquire_extra_jobs(1)
+    running = []
+    max_running = []
+    lock = threading.Lock()
+
+    def run_in_buildenv(*args):
+        with lock:
+            running.append(args)
+            max_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    build_context.run_in_buildenv.side_effect = run_in_buildenv
+    compiler_config = MagicMock(
+        compiler='g++', compile_flags=[], include_path=[],
+        use_fdebug_prefix_map_flag=False, use_ccache=False)
+    cpp.compile_cc(build_context, compiler_config, ':builder', sources,
+                   tmp_dir, '/project', None)
+    assert 3 == build_context.run_in_buildenv.call_count
+    assert 3 == max(max_running)
+    # the extra job slots were released, and only they were released
+    assert 2 == build_context.acquire_extra_jobs(3)
+
+
+def test_calc_compile_key(tmp_dir):
+    os.makedirs(join('ws', 'foo'))
+    os.makedirs('include')
+    for path in (join('ws', 'foo', 'a.cc'), join('include', 'b.h')):
+        with open(path, 'w') as src_file:
+            src_file.write('v1')
+    with open(join('ws', 'foo', 'a.o.d'), 'w') as dep_file:
+        dep_file.write('/project/ws/foo/a.o: /project/ws/foo/a.cc '
+                       '/project/include/b.h /usr/include/c.h\n')
+
+    def compile_key():
+        return cpp.calc_compile_key(
+            'base', join(tmp_dir, 'ws', 'foo', 'a.o'), tmp_dir, '/project/.',
+            {})
+
+    key = compile_key()
+    assert key is not None
+    assert key != cpp.calc_compile_key(
+        'other', join(tmp_dir, 'ws', 'foo', 'a.o'), tmp_dir, '/project', {})
+    # project headers outside the workspace are hashed by content
+    with open(join('include', 'b.h'), 'w') as src_file:
+        src_file.write('v2')
+    assert key != compile_key()
+    os.remove(join('include', 'b.h'))
+    assert compile_key() is None
+
+
+def test_parse_depfile(tmp_dir):
+    with open('a.o.d', 'w') as dep_file:
+        dep_file.write('/project/a.o: /project/a.cc /project/a\\ b.h \\\n'
+                       ' /usr/include/c.h\n')
+    assert (['/project/a.cc', '/project/a b.h', '/usr/include/c.h'] ==
+            cpp.parse_depfile('a.o.d'))
+    assert cpp.parse_depfile('b.o.d') is None
+
+
+def test_compile_cc_incremental(tmp_dir):
+    build_context = mock_compile_context(
+        tmp_dir, ['a.cc', 'b.cc', 'a.h', 'b.h'])
+    compiler_config = MagicMock(
+        compiler='g++', compile_flags=[], include_path=[],
+        use_fdebug_prefix_map_flag=False, use_ccache=False)
+
+    compiled = []
+
+    def fake_compile(buildenv, cmd, cmd_env):
+        # "compile" the objects (a.cc includes a.h, b.cc includes nothing)
+        with open(join(tmp_dir, 'compile.sh')) as script_file:
+            for line in script_file.read().splitlines()[1:]:
+                src = line.split()[-1]
+                obj = src[len('/project/'):-len('.cc')] + '.o'
+                open(obj, 'a').close()
+                with open(obj + '.d', 'w') as dep_file:
+                    dep_file.write('/project/{}: {}{}\n'.format(
+                        obj, src, ' /project/a.h' if obj == 'a.o' else ''))
+                compiled.append(src)
+
+    build_context.run_in_buildenv.side_effect = fake_compile
+
+    def compile_and_get_compiled():
+        compiled.clear()
+        objects = cpp.compile_cc(
+            build_context, compiler_config, ':builder', ['a.cc', 'b.cc'],
+            tmp_dir, '/project', None)
+        assert ['./a.o', './b.o'] == objects
+        return list(compiled)
+
+    assert ['/project/a.cc', '/project/b.cc'] == compile_and_get_compiled()
+    assert [] == compile_and_get_compiled()
+    # changed source is compiled again
+    with open('a.cc', 'a') as src_file:
+        src_file.write('// changed')
+    assert ['/project/a.cc'] == compile_and_get_compiled()
+    # missing object is compiled again
+    os.remove('b.o')
+    assert ['/project/b.cc'] == compile_and_get_compiled()
+    # only sources that include a changed header are compiled again
+    with open('a.h', 'a') as header_file:
+        header_file.write('// changed')
+    assert ['/project/a.cc'] == compile_and_get_compiled()
+    with open('b.h', 'a') as header_file:
+        header_file.write('// changed')
+    assert [] == compile_and_get_compiled()
+    # changed flags compile everything again
+    compiler_config.compile_flags = ['-O2']
+    assert ['/project/a.cc', '/project/b.cc'] == compile_and_get_compiled()
+
+
+@pytest.mark.usefixtures('in_cpp_project')
+def test_intern_compiler_config(basic_conf):
+    build_context = BuildContext(basic_conf)
+    basic_conf.targets = ['compiler_config:defaults',
+                          'compiler_config:override-compiler']
+    populate_targets_graph(build_context, basic_conf)
+    configs = [
+        cpp.intern_compiler_config(
+            build_context, cpp.CompilerConfig(build_context, target))
+        for target in (build_context.targets['compiler_config:defaults'],
+                       build_context.targets['compiler_config:defaults'],
+                       build_context.targets[
+                           'compiler_config:override-compiler'])]
+    assert configs[0] is configs[1]
+    assert configs[0] is not configs[2]
+    assert configs[0].digest != configs[2].digest
+
+
+@pytest.mark.usefixtures('in_cpp_project')
+def test_pre_build_hook_shares_compiler_configs(basic_conf):
+    build_context = BuildContext(basic_conf)
+    basic_conf.targets = ['compiler_config:defaults',
+                          'compiler_config:override-flags-empty',
+                          'compiler_config:override-compiler']
+    populate_targets_graph(build_context, basic_conf)
+    targets = [build_context.targets[target_name]
+               for target_name in basic_conf.targets]
+    with patch.object(cpp, 'CompilerConfig',
+                      wraps=cpp.CompilerConfig) as compiler_config_cls:
+        for target in targets:
+            target.pre_build_hook(build_context, target)
+    # empty compile flags fall back to the defaults, like no flags at all
+    assert 2 == compiler_config_cls.call_count
+    assert targets[0].compiler_config is targets[1].compiler_config
+    assert targets[0].compiler_config is not targets[2].compiler_config
+
+
 @pytest.mark.parametrize(
     'test_case',
     (
@@ -93,18 +480,16 @@ def test_compiler_config(basic_conf, test_case):
          ['-foo', 'bar', '-std=c++14', '-Wall', '-fcolor-diagnostics',
           '-g', '-DDEBUG']),
     ))
-def test_compiler_config_debug(debug_conf, test_case):
+def test_compiler_config_debug(compiler_config_debug_context, test_case):
     target_name, exp_compiler, exp_flags = test_case
-    build_context = BuildContext(debug_conf)
-    debug_conf.targets = [target_name]
-    populate_targets_graph(build_context, debug_conf)
+    build_context = compiler_config_debug_context
     target = build_context.targets[target_name]
     cc = cpp.CompilerConfig(build_context, target)
     assert cc.compiler == exp_compiler
     assert cc.compile_flags == exp_flags
     # also check flavored workspace dir
     assert (build_context.get_workspace('foo', 'bar:baz') ==
-            join(debug_conf.project_root,
+            join(build_context.conf.project_root,
                  'yabtwork', 'debug_flavor', 'foo', 'bar_baz'))
 
 
@@ -25,16 +25,28 @@ yabt Custom Installer Builder
 
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+import hashlib
+import json
 import os
 from os.path import basename, isdir, join, relpath, splitext
+import posixpath
 import shutil
+import stat
+from subprocess import CalledProcessError, PIPE, Popen
 import tarfile
-from urllib.parse import urlparse
+import threading
+import time
+from urllib.parse import urldefrag, urlparse
+from weakref import WeakKeyDictionary
 from zipfile import ZipFile
 
 import git
 from git import InvalidGitRepositoryError, NoSuchPathError
 import requests
+from requests.adapters import HTTPAdapter
 
 from ..artifact import ArtifactType as AT
 from ..extend import (
@@ -42,11 +54,20 @@ from ..extend import (
     register_manipulate_target_hook)
 from ..logging import make_logger
 from ..target_utils import split_name
-from ..utils import rmtree, yprint
+from ..utils import acc_hash, link_node, rmtree, yprint
 
 
 logger = make_logger(__name__)
 
+# Maximal number of URIs that are fetched concurrently per target
+MAX_FETCH_WORKERS = 8
+# A shared session, so downloads reuse connections (keep-alive)
+_SESSION = requests.Session()
+_SESSION.mount('http://', HTTPAdapter(pool_connections=MAX_FETCH_WORKERS,
+                                      pool_maxsize=MAX_FETCH_WORKERS))
+_SESSION.mount('https://', HTTPAdapter(pool_connections=MAX_FETCH_WORKERS,
+                                       pool_maxsize=MAX_FETCH_WORKERS))
+
 
 register_builder_sig(
     'CustomInstaller',
@@ -56,17 +77,69 @@ register_builder_sig(
      ('script_args', PT.StrList, None),
      ('uri', PT.str, None),  # deprecated
      ('uri_type', PT.str, None),  # deprecated
+     # an internal "prop" used internally bt YBT to add package config data
+     # to the target props, so it is considered by target hashing (for cache)
+     ('_internal_dict_', PT.dict, None),
      ])
 
 
 CustomInstaller = namedtuple('CustomInstaller',
                              ['name', 'package', 'install_script'])
-FetchDesc = namedtuple('FetchDesc', ['uri', 'type', 'name'])
-
-
+# Git repositories are cloned shallowly by default (`depth` of the fetch),
+# a depth of 0 (or None) clones the full history.
+# Git repositories are added to the package from their working tree by
+# default, or from `git archive` of HEAD if `git_archive` is set (see
+# `git_handler` for the differences).
+# The `filename` (last URI path component) & its lowercase `ext` are derived
+# from the URI once, by `make_fetch_desc`.
+FetchDesc = namedtuple('FetchDesc', ['uri', 'type', 'name', 'sha256', 'depth',
+                                     'filename', 'ext', 'git_archive'],
+                       defaults=(None, 1, None, None, False))
+
+
+# Map from build context to a {(URL, sha256): file} map of the files that
+# were already fetched in the build, so URLs that are fetched by several
+# targets (or fetches) are downloaded only once per build
+_FETCHED_URLS = WeakKeyDictionary()
+_FETCHED_URLS_LOCK = threading.Lock()
+# Size of the chunks that downloads are written in (1 MiB)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Extension of the files that store the validators (the ETag and
+# Last-Modified headers) of cached downloads, as JSON
+VALIDATORS_EXT = '.validators'
+# Map from validator response header to the conditional request header that
+# it is sent back in
+CONDITIONAL_HEADERS = {
+    'ETag': 'If-None-Match',
+    'Last-Modified': 'If-Modified-Since',
+}
+# (keep in sync with ARCHIVE_STREAMERS)
 KNOWN_ARCHIVES = frozenset(('.gz', '.bz2', '.tgz', '.zip'))
-
-
+# Size of the write buffer of package tarballs (1 MiB), so tar blocks and
+# compressed chunks are written in few large writes
+PACKAGE_BUFFER_SIZE = 1024 * 1024
+# Map from package tarball compression (the `custom_installer_compression`
+# config, gzip by default) to a (tarfile mode, tarball extension) tuple.
+# Uncompressed tarballs are cheaper to build, and Docker compresses the image
+# layers anyway.
+TARBALL_COMPRESSIONS = {
+    'gzip': ('w:gz', '.tar.gz'),
+    'none': ('w', '.tar'),
+}
+
+
+def make_fetch_desc(uri: str, type: str=None, name: str=None,
+                    sha256: str=None, depth: int=1,
+                    git_archive: bool=False) -> FetchDesc:
+    """Return a FetchDesc of `uri`, with its filename & extension."""
+    filename = basename(urlparse(uri).path) if uri else ''
+    return FetchDesc(uri=uri, type=type, name=name, sha256=sha256,
+                     depth=depth, filename=filename,
+                     ext=splitext(filename)[-1].lower(),
+                     git_archive=git_archive)
+
+
+@lru_cache(maxsize=4096)
 def guess_uri_type(uri: str, hint: str=None):
     """Return a guess for the URI type based on the URI string `uri`.
 
@@ -74,16 +147,19 @@ def guess_uri_type(uri: str, hint: str=None):
     Otherwise, the URI is inspected using urlparse, and we try to guess
     whether it's a remote Git repository, a remote downloadable archive,
     or a local-only data.
+
+    Results are memoized, as the same URIs are guessed in every build.
     """
     # TODO(itamar): do this better
     if hint:
         return hint
-    norm_uri = uri.lower()
-    parsed_uri = urlparse(norm_uri)
-    if parsed_uri.path.endswith('.git'):
+    parsed_uri = urlparse(uri)
+    # the scheme is normalized by urlparse - only the path needs lowering
+    path = parsed_uri.path.lower()
+    if path.endswith('.git'):
         return 'git'
     if parsed_uri.scheme in ('http', 'https'):
-        ext = splitext(parsed_uri.path)[-1]
+        ext = splitext(path)[-1]
         if ext in KNOWN_ARCHIVES:
             return 'archive'
         return 'single'
@@ -97,86 +173,366 @@ def gitfilter(tarinfo):
     return tarinfo
 
 
-def git_handler(unused_build_context, target, fetch, package_dir, tar):
-    """Handle remote Git repository URI.
+def git_repo_dir(fetch, package_dir) -> str:
+    """Return the directory that the Git repository of `fetch` is cloned to
+       under `package_dir`."""
+    return join(package_dir, fetch.name) if fetch.name else package_dir
 
-    Clone the repository under the private builder workspace (unless already
-    cloned), and add it to the package tar (filtering out git internals).
+
+def clone_git_repo(unused_build_context, fetch, package_dir):
+    """Clone a remote Git repository URI under the private builder workspace
+       (unless already cloned).
+
+    Only the latest `depth` commits of the default branch are cloned (without
+    tags), unless the fetch depth is 0 (or None).
 
     TODO(itamar): Support branches / tags / specific commit hashes
     TODO(itamar): Support updating a cloned repository
     TODO(itamar): Handle submodules?
     TODO(itamar): Handle force pulls?
     """
-    target_name = split_name(target.name)
-    # clone the repository under a private builder workspace
-    repo_dir = join(package_dir, fetch.name) if fetch.name else package_dir
+    repo_dir = git_repo_dir(fetch, package_dir)
     try:
         repo = git.Repo(repo_dir)
     except (InvalidGitRepositoryError, NoSuchPathError):
-        repo = git.Repo.clone_from(fetch.uri, repo_dir)
+        clone_options = (['--depth={}'.format(fetch.depth), '--single-branch',
+                          '--no-tags'] if fetch.depth else [])
+        repo = git.Repo.clone_from(fetch.uri, repo_dir,
+                                   multi_options=clone_options)
     assert repo.working_tree_dir == repo_dir
-    tar.add(package_dir, arcname=target_name, filter=gitfilter)
 
 
-def fetch_url(url, dest, parent_to_remove_before_fetch):
-    """Helper function to fetch a file from a URL."""
+def git_handler(unused_build_context, target, fetch, package_dir, tar):
+    """Handle remote Git repository URI.
+
+    Add the working tree of the repository that was cloned under the private
+    builder workspace to the package tar (filtering out git internals).
+
+    If the fetch sets `git_archive`, the HEAD tree is streamed from
+    `git archive` instead (without walking the working tree), which changes
+    the package content:
+    - paths marked `export-ignore` in .gitattributes are left out,
+    - symlinks are added as symlinks (and not dereferenced), and like
+      symlinks in fetched archives, they must point inside the repository.
+    """
+    repo_dir = git_repo_dir(fetch, package_dir)
+    prefix = split_name(target.name)
+    if fetch.name:
+        prefix = posixpath.join(prefix, fetch.name)
+    if not fetch.git_archive:
+        tar.add(repo_dir, arcname=prefix, filter=gitfilter)
+        return
+    archive_proc = git.Repo(repo_dir).git.archive(
+        '--format=tar', 'HEAD', as_process=True)
+    try:
+        with tarfile.open(fileobj=archive_proc.stdout, mode='r|') as src_tar:
+            stream_tar_members(src_tar, tar, prefix, tarinfo_filter=gitfilter)
+    except BaseException:
+        # don't leave `git archive` blocked on writing to a pipe that is no
+        # longer read
+        archive_proc.kill()
+        archive_proc.proc.wait()
+        raise
+    # raises GitCommandError if archiving failed
+    archive_proc.wait()
+
+
+def download_url(url, dest, validators: dict=None) -> dict:
+    """Download a file from a URL to `dest`, and return its validators (the
+       ETag & Last-Modified response headers the server sent, if any).
+
+    If `validators` of a previous download are given, the request is
+    conditional - if the server responds that the file wasn't modified since,
+    nothing is downloaded, and None is returned.
+    """
     logger.debug('Downloading file {} from {}', dest, url)
+    # TODO(itamar): Better downloading (multi-process-multi-threaded?)
+    # Consider offloading this to a "standalone app" invoked with Docker
+    headers = {CONDITIONAL_HEADERS[name]: value
+               for name, value in (validators or {}).items()
+               if name in CONDITIONAL_HEADERS}
+    with _SESSION.get(url, stream=True, headers=headers) as resp:
+        if validators and resp.status_code == 304:
+            return None
+        resp.raise_for_status()
+        # copy the raw stream in large chunks (decoding any
+        # Content-Encoding, as `iter_content` does), with less per-chunk
+        # overhead than `iter_content`
+        resp.raw.decode_content = True
+        with open(dest, 'wb') as fetch_file:
+            shutil.copyfileobj(resp.raw, fetch_file, DOWNLOAD_CHUNK_SIZE)
+        return {name: resp.headers[name] for name in CONDITIONAL_HEADERS
+                if name in resp.headers}
+
+
+def hash_file_sha256(filepath: str) -> str:
+    """Return the hexdigest SHA-256 hash of content of file at `filepath`."""
+    sha256 = hashlib.sha256()
+    acc_hash(filepath, sha256)
+    return sha256.hexdigest()
+
+
+def read_validators(cache_file: str) -> dict:
+    """Return the validators of `cache_file` (a cached download), or None if
+       it has no validators (so it can't be validated)."""
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        with open(cache_file + VALIDATORS_EXT, 'r') as validators_file:
+            return json.load(validators_file) or None
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def reset_dir(path: str):
+    """Remove the directory at `path` (if it exists), and create it empty."""
     try:
-        shutil.rmtree(parent_to_remove_before_fetch)
+        shutil.rmtree(path)
     except FileNotFoundError:
         pass
-    os.makedirs(parent_to_remove_before_fetch)
-    # TODO(itamar): Better downloading (multi-process-multi-threaded?)
-    # Consider offloading this to a "standalone app" invoked with Docker
-    resp = requests.get(url, stream=True)
-    with open(dest, 'wb') as fetch_file:
-        for chunk in resp.iter_content(chunk_size=32 * 1024):
-            fetch_file.write(chunk)
+    os.makedirs(path)
+
+
+def fetch_url(url, dest, parent_to_remove_before_fetch,
+              cache_dir: str=None, sha256: str=None):
+    """Helper function to fetch a file from a URL.
+
+    If `cache_dir` is given, downloads are cached there - content-addressed,
+    if the `sha256` of the file is given, or by URL otherwise - and valid
+    cached downloads are hard-linked to `dest` instead of downloaded again.
+    Downloads cached by URL are valid if a conditional request (with their
+    validators) responds that they weren't modified.
+
+    :raises ValueError: If the SHA-256 hash of the downloaded file doesn't
+                        match `sha256`.
+    """
+    reset_dir(parent_to_remove_before_fetch)
+    if not cache_dir:
+        download_url(url, dest)
+        return
+    cache_file = join(cache_dir, 'sha256-{}'.format(sha256) if sha256 else
+                      'url-{}'.format(
+                          hashlib.sha256(url.encode('utf8')).hexdigest()))
+    # content-addressed cache files are validated when they're downloaded
+    if sha256 and os.path.isfile(cache_file):
+        logger.debug('Using cached download of {}', url)
+        link_node(cache_file, dest)
+        return
+    validators = None if sha256 else read_validators(cache_file)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = '{}.{}.tmp'.format(cache_file, threading.get_ident())
+    try:
+        new_validators = download_url(url, tmp_file, validators)
+        if new_validators is None:
+            logger.debug('Using cached download of {} (not modified)', url)
+            link_node(cache_file, dest)
+            return
+        if sha256 and hash_file_sha256(tmp_file) != sha256.lower():
+            raise ValueError('SHA-256 mismatch for file downloaded from {}'
+                             .format(url))
+        # drop the validators of the previous download before replacing it
+        try:
+            os.remove(cache_file + VALIDATORS_EXT)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_file, cache_file)
+    finally:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+    if new_validators and not sha256:
+        with open(cache_file + VALIDATORS_EXT, 'w') as validators_file:
+            json.dump(new_validators, validators_file)
+    link_node(cache_file, dest)
+
+
+def fetch_url_once(build_context, fetch, dest,
+                   parent_to_remove_before_fetch):
+    """Fetch the URI of `fetch` to `dest`, hard-linking it from a previous
+       fetch of the same URI in this build, if there is one.
+
+    The URI fragment is ignored (it is not sent to the server), but the query
+    is not (it may select the content, or authorize the download).
+    """
+    key = (urldefrag(fetch.uri).url, fetch.sha256)
+    with _FETCHED_URLS_LOCK:
+        fetched_file = _FETCHED_URLS.setdefault(build_context, {}).get(key)
+    if fetched_file and os.path.isfile(fetched_file):
+        logger.debug('Using file {} already fetched from {}',
+                     fetched_file, fetch.uri)
+        reset_dir(parent_to_remove_before_fetch)
+        link_node(fetched_file, dest)
+        return
+    fetch_url(fetch.uri, dest, parent_to_remove_before_fetch,
+              build_context.conf.get_downloads_cache_dir(), fetch.sha256)
+    with _FETCHED_URLS_LOCK:
+        _FETCHED_URLS[build_context][key] = dest
+
+
+def fetch_archive(build_context, fetch, package_dir):
+    """Download a remote archive URI to the private builder workspace."""
+    fetch_url_once(build_context, fetch, join(package_dir, fetch.filename),
+                   package_dir)
+
+
+def join_member_name(prefix: str, name: str) -> str:
+    """Return the name of archive member `name` in the package tar, when
+       added under `prefix`.
+
+    :raises ValueError: If `name` is absolute, or escapes `prefix`.
+    """
+    norm_name = posixpath.normpath(name)
+    if norm_name == '.':
+        return prefix
+    if (norm_name.startswith('/') or norm_name == '..' or
+            norm_name.startswith('../')):
+        raise ValueError('Unsafe archive member path "{}"'.format(name))
+    return posixpath.join(prefix, norm_name)
+
+
+def check_symlink_target(name: str, linkname: str):
+    """Check that the archive symlink member `name` (pointing at `linkname`)
+       points at a path inside the archive.
+
+    The check is lexical (symlinks are not followed), like the check of
+    member names.
+
+    :raises ValueError: If `linkname` is absolute, or escapes the archive.
+    """
+    link_target = posixpath.normpath(posixpath.join(
+        posixpath.dirname(posixpath.normpath(name)), linkname))
+    if (linkname.startswith('/') or link_target == '..' or
+            link_target.startswith('../')):
+        raise ValueError('Unsafe archive symlink "{}" -> "{}"'.format(
+            name, linkname))
+
+
+def stream_tar_members(src_tar, tar, prefix: str, tarinfo_filter=None):
+    """Add all the members of `src_tar` to `tar` under `prefix`, streaming
+       their content (without extracting them).
+
+    Symlinks are added as symlinks, as long as they point inside the archive
+    (so they're not dangling once the package is extracted).
+
+    If `tarinfo_filter` is given, members it returns None for are skipped
+    (like the `filter` of `TarFile.add`).
+    """
+    for member in src_tar:
+        if tarinfo_filter and tarinfo_filter(member) is None:
+            continue
+        fileobj = src_tar.extractfile(member) if member.isfile() else None
+        if member.issym():
+            # symlinks are relative to their own member, so they stay valid
+            # under `prefix`
+            check_symlink_target(member.name, member.linkname)
+        member.name = join_member_name(prefix, member.name)
+        if member.islnk():
+            # hard links refer to other members of the archive
+            member.linkname = join_member_name(prefix, member.linkname)
+        tar.addfile(member, fileobj)
+
+
+def stream_zip_members(zipf, tar, prefix: str):
+    """Add all the members of `zipf` to `tar` under `prefix`, streaming
+       their content (without extracting them)."""
+    for info in zipf.infolist():
+        member = tarfile.TarInfo(join_member_name(prefix, info.filename))
+        member.mtime = time.mktime(info.date_time + (0, 0, -1))
+        # permissions are stored in the high bits, if zipped on Unix
+        mode = stat.S_IMODE(info.external_attr >> 16)
+        if info.is_dir():
+            member.type = tarfile.DIRTYPE
+            member.mode = mode or 0o755
+            tar.addfile(member)
+        else:
+            member.size = info.file_size
+            member.mode = mode or 0o644
+            with zipf.open(info) as fileobj:
+                tar.addfile(member, fileobj)
+
+
+def stream_tar_archive(archive_path: str, tar, prefix: str):
+    """Add all the members of the tarball at `archive_path` to `tar` under
+       `prefix` (any compression supported by tarfile)."""
+    with tarfile.open(archive_path, 'r:*') as src_tar:
+        stream_tar_members(src_tar, tar, prefix)
+
+
+def stream_gzip_tar_archive(archive_path: str, tar, prefix: str):
+    """Add all the members of the gzipped tarball at `archive_path` to `tar`
+       under `prefix`.
+
+    The tarball is decompressed by `pigz` if it is installed, in a separate
+    process (pipelined with streaming the members). Otherwise, it is
+    decompressed by tarfile.
+    """
+    pigz = shutil.which('pigz')
+    if not pigz:
+        stream_tar_archive(archive_path, tar, prefix)
+        return
+    pigz_proc = Popen([pigz, '-dc', archive_path], stdout=PIPE)
+    try:
+        with tarfile.open(fileobj=pigz_proc.stdout, mode='r|') as src_tar:
+            stream_tar_members(src_tar, tar, prefix)
+    finally:
+        pigz_proc.stdout.close()
+        pigz_proc.wait()
+    if pigz_proc.returncode:
+        raise CalledProcessError(pigz_proc.returncode, pigz_proc.args)
+
+
+def stream_zip_archive(archive_path: str, tar, prefix: str):
+    """Add all the members of the zip archive at `archive_path` to `tar`
+       under `prefix`."""
+    with ZipFile(archive_path, 'r') as zipf:
+        stream_zip_members(zipf, tar, prefix)
+
+
+# Map from (lowercase) archive extension to a function that adds the members
+# of an archive with that extension to the package tar
+ARCHIVE_STREAMERS = {
+    '.gz': stream_gzip_tar_archive,
+    '.bz2': stream_tar_archive,
+    '.tgz': stream_gzip_tar_archive,
+    '.zip': stream_zip_archive,
+}
 
 
 def archive_handler(unused_build_context, target, fetch, package_dir, tar):
     """Handle remote downloadable archive URI.
 
-    Download the archive and cache it under the private builer workspace
-    (unless already downloaded), extract it, and add the content to the
-    package tar.
+    Add the content of the archive that was downloaded to the private builder
+    workspace to the package tar, streaming the archive members directly
+    (without extracting them).
 
     TODO(itamar): Support re-downloading if remote changed compared to local.
     TODO(itamar): Support more archive formats (currently only tarballs).
     """
-    package_dest = join(package_dir, basename(urlparse(fetch.uri).path))
-    package_content_dir = join(package_dir, 'content')
-    extract_dir = (join(package_content_dir, fetch.name)
-                   if fetch.name else package_content_dir)
-    fetch_url(fetch.uri, package_dest, package_dir)
-
-    # TODO(itamar): Avoid repetition of splitting extension here and above
-    # TODO(itamar): Don't use `extractall` on potentially untrsuted archives
-    ext = splitext(package_dest)[-1].lower()
-    if ext in ('.gz', '.bz2', '.tgz'):
-        with tarfile.open(package_dest, 'r:*') as src_tar:
-            src_tar.extractall(extract_dir)
-    elif ext in ('.zip',):
-        with ZipFile(package_dest, 'r') as zipf:
-            zipf.extractall(extract_dir)
-    else:
-        raise ValueError('Unsupported extension {}'.format(ext))
-    tar.add(package_content_dir, arcname=split_name(target.name))
+    package_dest = join(package_dir, fetch.filename)
+    prefix = split_name(target.name)
+    if fetch.name:
+        prefix = posixpath.join(prefix, fetch.name)
+
+    stream_archive = ARCHIVE_STREAMERS.get(fetch.ext)
+    if stream_archive is None:
+        raise ValueError('Unsupported extension {}'.format(fetch.ext))
+    stream_archive(package_dest, tar, prefix)
+
+
+def fetch_file(build_context, fetch, package_dir):
+    """Download a remote file URI to the private builder workspace."""
+    dl_dir = join(package_dir, fetch.name) if fetch.name else package_dir
+    fetch_url_once(build_context, fetch, join(dl_dir, fetch.filename),
+                   dl_dir)
 
 
 def fetch_file_handler(unused_build_context, target, fetch, package_dir, tar):
     """Handle remote downloadable file URI.
 
-    Download the file and cache it under the private builer workspace
-    (unless already downloaded), and add it to the package tar.
+    Add the file that was downloaded to the private builder workspace to the
+    package tar.
 
     TODO(itamar): Support re-downloading if remote changed compared to local.
     """
-    dl_dir = join(package_dir, fetch.name) if fetch.name else package_dir
-    fetch_url(fetch.uri,
-              join(dl_dir, basename(urlparse(fetch.uri).path)),
-              dl_dir)
     tar.add(package_dir, arcname=split_name(target.name))
 
 
@@ -184,16 +540,66 @@ def local_handler(build_context, target, fetch, package_dir, tar):
     pass
 
 
+# Map from URI type to a function that fetches remote URIs of that type to
+# the private builder workspace (local URIs are not fetched)
+FETCHERS = {
+    'git': clone_git_repo,
+    'archive': fetch_archive,
+    'single': fetch_file,
+}
+# Map from URI type to a function that adds fetched URIs of that type to the
+# package tar
+HANDLERS = {
+    'git': git_handler,
+    'archive': archive_handler,
+    'single': fetch_file_handler,
+    'local': local_handler,
+}
+
+
 def get_installer_desc(build_context, target) -> tuple:
     """Return a target_name, script, args, package_tarball
        tuple for `target`"""
     workspace_dir = build_context.get_workspace('CustomInstaller', target.name)
     target_name = split_name(target.name)
     script_name = basename(target.props.script)
-    package_tarball = '{}.tar.gz'.format(join(workspace_dir, target_name))
+    _, tarball_ext = TARBALL_COMPRESSIONS[
+        target.props._internal_dict_['compression']]
+    package_tarball = join(workspace_dir, target_name) + tarball_ext
     return target_name, script_name, target.props.script_args, package_tarball
 
 
+@contextmanager
+def open_package_tar(package_tarball: str, compression: str):
+    """Yield a tar file that writes the package tarball with `compression`.
+
+    Gzip compression is done by `pigz` (on all cores) if it is installed,
+    with the tar streamed to its stdin. Otherwise, it is done by tarfile
+    (single-threaded). Either way, writes are buffered in large chunks.
+    """
+    pigz = shutil.which('pigz') if compression == 'gzip' else None
+    if not pigz:
+        tar_mode, _ = TARBALL_COMPRESSIONS[compression]
+        with open(package_tarball, 'wb',
+                  buffering=PACKAGE_BUFFER_SIZE) as tarball_file, \
+                tarfile.open(fileobj=tarball_file, mode=tar_mode,
+                             dereference=True) as tar:
+            yield tar
+        return
+    with open(package_tarball, 'wb') as tarball_file:
+        pigz_proc = Popen([pigz, '-c'], stdin=PIPE, stdout=tarball_file,
+                          bufsize=PACKAGE_BUFFER_SIZE)
+        try:
+            with tarfile.open(fileobj=pigz_proc.stdin, mode='w|',
+                              dereference=True) as tar:
+                yield tar
+        finally:
+            pigz_proc.stdin.close()
+            pigz_proc.wait()
+    if pigz_proc.returncode:
+        raise CalledProcessError(pigz_proc.returncode, pigz_proc.args)
+
+
 @register_build_func('CustomInstaller')
 def custom_installer_builder(build_context, target):
     yprint(build_context.conf, 'Fetch custom installer package', target)
@@ -212,25 +618,22 @@ def custom_installer_builder(build_context, target):
         build_context, target)
 
     logger.debug('Making custom installer package {}', package_tarball)
-    handlers = {
-        'git': git_handler,
-        'archive': archive_handler,
-        'single': fetch_file_handler,
-        'local': local_handler,
-    }
 
     def to_fetch_desc(fetch_arg):
         if isinstance(fetch_arg, dict):
-            return FetchDesc(
+            return make_fetch_desc(
                 uri=fetch_arg['uri'], type=fetch_arg.get('type', None),
-                name=fetch_arg.get('name', None))
+                name=fetch_arg.get('name', None),
+                sha256=fetch_arg.get('sha256', None),
+                depth=fetch_arg.get('depth', 1),
+                git_archive=fetch_arg.get('git_archive', False))
         assert isinstance(fetch_arg, str)
-        return FetchDesc(uri=fetch_arg, type=None, name='')
+        return make_fetch_desc(uri=fetch_arg, type=None, name='')
 
     fetches = ([to_fetch_desc(fetch) for fetch in target.props.fetch]
                if target.props.fetch
-               else [FetchDesc(name='', uri=target.props.uri,
-                               type=target.props.uri_type)])
+               else [make_fetch_desc(name='', uri=target.props.uri,
+                                     type=target.props.uri_type)])
     if len(fetches) > 1 and any(fetch.name is None for fetch in fetches):
         raise ValueError('{}: Implicit empty name not allowed with multiple '
                          'fetches. To fetch a URI under the top dir, '
@@ -241,27 +644,54 @@ def custom_installer_builder(build_context, target):
             raise ValueError('{}: Duplicate fetch name "{}"'.format(
                 target.name, fetch.name))
         used_names.add(fetch.name)
-    tar = tarfile.open(package_tarball, 'w:gz', dereference=True)
+    fetch_args = []
+    packages_dir = join(workspace_dir, target_name)
     for fetch in fetches:
         uri_type = guess_uri_type(fetch.uri, fetch.type)
         logger.debug('CustomInstaller URI {} typed guessed to be {}',
                      fetch.uri, uri_type)
-        package_dir = join(workspace_dir, target_name,
-                           fetch.name or '_unnamed_')
-        handlers[uri_type](build_context, target, fetch, package_dir, tar)
-    # Add local data to installer package, if specified
-    for local_node in target.props.local_data:
-        tar.add(join(build_context.conf.project_root, local_node),
-                arcname=join(target_name, local_node))
-    # Add the install script to the installer package
-    tar.add(join(build_context.conf.project_root, target.props.script),
-            arcname=join(target_name, script_name))
-    tar.close()
+        package_dir = join(packages_dir, fetch.name or '_unnamed_')
+        fetch_args.append((uri_type, fetch, package_dir))
+    # download / clone all the remote URIs concurrently (they're independent
+    # and network bound), before adding them to the package tar serially
+    remote_fetches = [(FETCHERS[uri_type], fetch, package_dir)
+                      for uri_type, fetch, package_dir in fetch_args
+                      if uri_type in FETCHERS]
+    if len(remote_fetches) == 1:
+        fetcher, fetch, package_dir = remote_fetches[0]
+        fetcher(build_context, fetch, package_dir)
+    elif remote_fetches:
+        with ThreadPoolExecutor(max_workers=min(
+                MAX_FETCH_WORKERS, len(remote_fetches))) as executor:
+            futures = [executor.submit(fetcher, build_context, fetch,
+                                       package_dir)
+                       for fetcher, fetch, package_dir in remote_fetches]
+            # get the results, so failures are raised here
+            for future in futures:
+                future.result()
+    project_root = build_context.conf.project_root
+    with open_package_tar(package_tarball,
+                          target.props._internal_dict_['compression']) as tar:
+        for uri_type, fetch, package_dir in fetch_args:
+            HANDLERS[uri_type](build_context, target, fetch, package_dir, tar)
+        # Add local data to installer package, if specified
+        for local_node in target.props.local_data:
+            tar.add(join(project_root, local_node),
+                    arcname=join(target_name, local_node))
+        # Add the install script to the installer package
+        tar.add(join(project_root, target.props.script),
+                arcname=join(target_name, script_name))
     target.artifacts.add(
-        AT.custom_installer,
-        relpath(package_tarball, build_context.conf.project_root))
+        AT.custom_installer, relpath(package_tarball, project_root))
 
 
 @register_manipulate_target_hook('CustomInstaller')
 def custom_installer_manipulate_target(build_context, target):
     target.tags.add('custom-installer')
+    compression = build_context.conf.get(
+        'custom_installer_compression', 'gzip')
+    if compression not in TARBALL_COMPRESSIONS:
+        raise ValueError(
+            'Unsupported custom installer compression "{}" (expected one of '
+            '{})'.format(compression, ', '.join(sorted(TARBALL_COMPRESSIONS))))
+    target.props._internal_dict_['compression'] = compression
@@ -1,6 +1,18 @@
+import hashlib
+import io
+import os
+from os.path import join
+import shutil
 from subprocess import check_output
+import tarfile
+from unittest.mock import MagicMock, patch
+from zipfile import ZipFile
+
+import git
 import pytest
 
+from . import custom_installer
+from .custom_installer import make_fetch_desc
 from yabt.buildcontext import BuildContext
 from yabt.graph import populate_targets_graph
 
@@ -16,3 +28,336 @@ def test_custom_installer_args(basic_conf):
         ['docker', 'run', '--rm', '--entrypoint', 'cat',
          build_context.targets[':w00t'].image_id, '/var/opt/w00t'])
     assert w00t_content == b'hello there\nhow are you doing\n'
+
+
+def make_package_tar(tmp_dir, archive_name, fetch_name, pigz=None):
+    """Return the members of a package tar with the archive at
+       `tmp_dir`/`archive_name` added to it by the archive handler (using
+       `pigz` as pigz), mapped to their content (files), link name (hard
+       links & symlinks) or type (others)."""
+
+    def fake_fetch_url(url, dest, parent_to_remove_before_fetch,
+                       cache_dir=None, sha256=None):
+        shutil.copy(url, dest)
+
+    target = MagicMock()
+    target.name = ':pkg'
+    fetch = make_fetch_desc(uri=join(tmp_dir, archive_name), type='archive',
+                            name=fetch_name)
+    package_dir = join(tmp_dir, 'pkg')
+    os.makedirs(package_dir)
+    with patch.object(custom_installer, 'fetch_url', fake_fetch_url):
+        custom_installer.fetch_archive(MagicMock(), fetch, package_dir)
+    with tarfile.open(join(tmp_dir, 'pkg.tar.gz'), 'w:gz') as tar, \
+            patch.object(custom_installer.shutil, 'which', return_value=pigz):
+        custom_installer.archive_handler(
+            None, target, fetch, package_dir, tar)
+    with tarfile.open(join(tmp_dir, 'pkg.tar.gz'), 'r:gz') as tar:
+        return {
+            member.name: (tar.extractfile(member).read() if member.isfile()
+                          else member.linkname if member.islnk() or
+                          member.issym()
+                          else member.type)
+            for member in tar}
+
+
+# gzip has the same decompression interface as pigz
+@pytest.mark.parametrize('pigz', (None, shutil.which('gzip')))
+def test_archive_handler_tarball(tmp_dir, pigz):
+    os.makedirs(join('src', 'bin'))
+    with open(join('src', 'bin', 'foo'), 'w') as foo_file:
+        foo_file.write('foo')
+    os.link(join('src', 'bin', 'foo'), join('src', 'foo-link'))
+    with tarfile.open('foo.tar.gz', 'w:gz') as src_tar:
+        src_tar.add(join('src', 'bin'), arcname='./bin')
+        src_tar.add(join('src', 'foo-link'), arcname='./foo-link')
+    assert {
+        'pkg/foo/bin': tarfile.DIRTYPE,
+        'pkg/foo/bin/foo': b'foo',
+        'pkg/foo/foo-link': 'pkg/foo/bin/foo',
+    } == make_package_tar(tmp_dir, 'foo.tar.gz', 'foo', pigz)
+
+
+def make_symlink_tarball(linkname: str):
+    with tarfile.open('foo.tar.gz', 'w:gz') as src_tar:
+        link = tarfile.TarInfo('bin/foo-link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = linkname
+        src_tar.addfile(link)
+
+
+def test_archive_handler_symlink(tmp_dir):
+    make_symlink_tarball('../lib/foo')
+    assert {
+        'pkg/foo/bin/foo-link': '../lib/foo',
+    } == make_package_tar(tmp_dir, 'foo.tar.gz', 'foo')
+
+
+@pytest.mark.parametrize('linkname', ('/etc/passwd', '../../foo', '../..'))
+def test_archive_handler_unsafe_symlink(tmp_dir, linkname):
+    make_symlink_tarball(linkname)
+    with pytest.raises(ValueError):
+        make_package_tar(tmp_dir, 'foo.tar.gz', 'foo')
+
+
+def test_archive_handler_zip(tmp_dir):
+    with ZipFile('foo.zip', 'w') as zipf:
+        zipf.writestr('bin/', '')
+        zipf.writestr('bin/foo', 'foo')
+    assert {
+        'pkg/bin': tarfile.DIRTYPE,
+        'pkg/bin/foo': b'foo',
+    } == make_package_tar(tmp_dir, 'foo.zip', '')
+
+
+def test_archive_handler_unsafe_member(tmp_dir):
+    with ZipFile('foo.zip', 'w') as zipf:
+        zipf.writestr('../foo', 'foo')
+    with pytest.raises(ValueError):
+        make_package_tar(tmp_dir, 'foo.zip', '')
+
+
+def test_archive_handler_unsupported_extension(tmp_dir):
+    with open('foo.rar', 'w') as rar_file:
+        rar_file.write('foo')
+    with pytest.raises(ValueError):
+        make_package_tar(tmp_dir, 'foo.rar', '')
+
+
+@pytest.mark.usefixtures('in_custom_installer_project')
+@pytest.mark.parametrize('compression,tarball_ext',
+                         ((None, '.tar.gz'), ('gzip', '.tar.gz'),
+                          ('none', '.tar')))
+def test_installer_tarball_compression(basic_conf, compression, tarball_ext):
+    if compression:
+        basic_conf.common_conf = dict(
+            basic_conf.common_conf or {},
+            custom_installer_compression=compression)
+    build_context = BuildContext(basic_conf)
+    basic_conf.targets = [':append-hello-to-w00t']
+    populate_targets_graph(build_context, basic_conf)
+    target = build_context.targets[':append-hello-to-w00t']
+    _, _, _, package_tarball = custom_installer.get_installer_desc(
+        build_context, target)
+    assert package_tarball.endswith('append-hello-to-w00t' + tarball_ext)
+
+
+@pytest.mark.usefixtures('in_custom_installer_project')
+def test_installer_tarball_unsupported_compression(basic_conf):
+    basic_conf.common_conf = dict(basic_conf.common_conf or {},
+                                  custom_installer_compression='rar')
+    build_context = BuildContext(basic_conf)
+    basic_conf.targets = [':append-hello-to-w00t']
+    with pytest.raises(SystemExit):
+        populate_targets_graph(build_context, basic_conf)
+
+
+@pytest.mark.parametrize('compression,pigz', (
+    ('gzip', None), ('gzip', shutil.which('gzip')), ('none', None)))
+def test_open_package_tar(tmp_dir, compression, pigz):
+    with open('foo', 'w') as foo_file:
+        foo_file.write('foo')
+    # gzip has the same stdin -> stdout interface as pigz
+    with patch.object(custom_installer.shutil, 'which', return_value=pigz):
+        with custom_installer.open_package_tar('pkg.tar', compression) as tar:
+            tar.add('foo', arcname='pkg/foo')
+    with open('pkg.tar', 'rb') as tarball_file:
+        assert (compression == 'gzip') == (tarball_file.read(2) ==
+                                           b'\x1f\x8b')
+    with tarfile.open('pkg.tar', 'r:*') as tar:
+        assert b'foo' == tar.extractfile('pkg/foo').read()
+
+
+def mock_session(content: bytes, etag: str=None):
+    """Return a mock requests session that serves `content` with `etag`
+       (responding to conditional requests with a matching ETag with 304)."""
+    session = MagicMock()
+    resp_headers = {'ETag': etag} if etag else {}
+
+    def get(url, stream, headers):
+        if etag and headers.get('If-None-Match') == etag:
+            resp = MagicMock(status_code=304)
+        else:
+            resp = MagicMock(status_code=200, raw=io.BytesIO(content),
+                             headers=resp_headers)
+        resp.__enter__.return_value = resp
+        return resp
+
+    session.get.side_effect = get
+    return session
+
+
+def test_fetch_url_validated_cache(tmp_dir):
+    url = 'https://example.com/foo.txt'
+
+    def fetch(session):
+        with patch.object(custom_installer, '_SESSION', session):
+            custom_installer.fetch_url(url, join('dl', 'foo.txt'), 'dl',
+                                       'cache')
+        with open(join('dl', 'foo.txt'), 'rb') as fetched_file:
+            return fetched_file.read()
+
+    session = mock_session(b'foo', '"v1"')
+    assert b'foo' == fetch(session)
+    assert b'foo' == fetch(session)
+    # the second fetch is a conditional request, served from the cache
+    assert {'If-None-Match': '"v1"'} == session.get.call_args[1]['headers']
+    assert b'bar' == fetch(mock_session(b'bar', '"v2"'))
+    # without validators there's no way to validate the cache
+    session = mock_session(b'baz')
+    assert b'baz' == fetch(session)
+    assert b'baz' == fetch(session)
+    assert {} == session.get.call_args[1]['headers']
+
+
+def test_fetch_url_sha256_cache(tmp_dir):
+    url = 'https://example.com/foo.txt'
+    sha256 = hashlib.sha256(b'foo').hexdigest()
+    session = mock_session(b'foo')
+    with patch.object(custom_installer, '_SESSION', session):
+        for _ in range(2):
+            custom_installer.fetch_url(url, join('dl', 'foo.txt'), 'dl',
+                                       'cache', sha256)
+        with pytest.raises(ValueError):
+            custom_installer.fetch_url(url, join('dl', 'foo.txt'), 'dl',
+                                       'cache', 'bad' + sha256)
+    # cached downloads with a declared hash are not validated remotely (the
+    # second get is of the mismatching download, that is not cached)
+    assert 2 == session.get.call_count
+    assert ['sha256-' + sha256] == os.listdir('cache')
+
+
+def test_make_fetch_desc():
+    fetch = make_fetch_desc('https://example.com/foo/Bar.TGZ?v=1#frag')
+    assert 'Bar.TGZ' == fetch.filename
+    assert '.tgz' == fetch.ext
+    assert '' == make_fetch_desc(None).filename
+
+
+def test_fetch_url_once(tmp_dir):
+    build_context = MagicMock()
+    build_context.conf.get_downloads_cache_dir.return_value = None
+    session = mock_session(b'foo')
+
+    def fetch(uri, name):
+        fetch = make_fetch_desc(uri=uri, type='single', name=name)
+        with patch.object(custom_installer, '_SESSION', session):
+            custom_installer.fetch_file(build_context, fetch, tmp_dir)
+        with open(join(tmp_dir, name, 'foo.txt'), 'rb') as fetched_file:
+            return fetched_file.read()
+
+    assert b'foo' == fetch('https://example.com/foo.txt', 'a')
+    assert b'foo' == fetch('https://example.com/foo.txt#b', 'b')
+    # the second fetch is hard-linked from the first one
+    assert 1 == session.get.call_count
+    assert b'foo' == fetch('https://example.com/foo.txt?v=2', 'c')
+    assert 2 == session.get.call_count
+
+
+@pytest.mark.parametrize('uri,hint,uri_type', (
+    ('https://github.com/foo/bar.git', None, 'git'),
+    ('HTTPS://GitHub.com/Foo/Bar.GIT', None, 'git'),
+    ('https://example.com/foo.tar.gz', None, 'archive'),
+    ('HTTP://example.com/FOO.ZIP', None, 'archive'),
+    ('https://example.com/foo.txt', None, 'single'),
+    ('https://example.com/foo.txt', 'archive', 'archive'),
+    ('foo/bar', None, 'local'),
+))
+def test_guess_uri_type(uri, hint, uri_type):
+    assert uri_type == custom_installer.guess_uri_type(uri, hint)
+
+
+def make_git_package_tar(tmp_dir, files: dict, symlinks: dict=None,
+                         git_archive: bool=False):
+    """Return the members of a package tar with a git repository with
+       `files` (path: content) & `symlinks` (path: link target) committed
+       added to it by the git handler, mapped to their content (files), link
+       name (symlinks) or type (others)."""
+    repo_dir = join(tmp_dir, 'pkg', 'bar')
+    for path, content in files.items():
+        os.makedirs(join(repo_dir, os.path.dirname(path)), exist_ok=True)
+        with open(join(repo_dir, path), 'w') as repo_file:
+            repo_file.write(content)
+    for path, linkname in (symlinks or {}).items():
+        os.makedirs(join(repo_dir, os.path.dirname(path)), exist_ok=True)
+        os.symlink(linkname, join(repo_dir, path))
+    repo = git.Repo.init(repo_dir)
+    repo.index.add([path for path in list(files) + list(symlinks or {})
+                    if not path.endswith('.o')])
+    repo.index.commit('init')
+    target = MagicMock()
+    target.name = ':pkg'
+    fetch = make_fetch_desc(uri='https://github.com/foo/bar.git',
+                            type='git', name='bar', git_archive=git_archive)
+    # like package tars, dereference symlinks that are added from the disk
+    with tarfile.open('pkg.tar', 'w', dereference=True) as tar:
+        custom_installer.git_handler(
+            None, target, fetch, join(tmp_dir, 'pkg'), tar)
+    with tarfile.open('pkg.tar', 'r') as tar:
+        return {member.name: (tar.extractfile(member).read()
+                              if member.isfile() else member.linkname
+                              if member.issym() else member.type)
+                for member in tar}
+
+
+def test_git_handler(tmp_dir):
+    assert {
+        'pkg/bar': tarfile.DIRTYPE,
+        'pkg/bar/README': b'hi',
+        'pkg/bar/src': tarfile.DIRTYPE,
+        'pkg/bar/src/foo.c': b'int x;',
+        'pkg/bar/src/foo.o': b'ignored',
+    } == make_git_package_tar(tmp_dir, {
+        'README': 'hi', '.gitignore': '*.o', 'src/foo.c': 'int x;',
+        'src/foo.o': 'ignored'})
+
+
+def test_git_handler_symlink(tmp_dir):
+    assert {
+        'pkg/bar': tarfile.DIRTYPE,
+        'pkg/bar/README': b'hi',
+        'pkg/bar/docs': tarfile.DIRTYPE,
+        'pkg/bar/docs/README': b'hi',
+    } == make_git_package_tar(tmp_dir, {'README': 'hi'},
+                              {'docs/README': '../README'})
+
+
+def test_git_handler_git_archive(tmp_dir):
+    assert {
+        'pkg/bar/README': b'hi',
+        'pkg/bar/src': tarfile.DIRTYPE,
+        'pkg/bar/src/foo.c': b'int x;',
+    } == make_git_package_tar(tmp_dir, {
+        'README': 'hi', '.gitignore': '*.o', 'src/foo.c': 'int x;',
+        'src/foo.o': 'ignored'}, git_archive=True)
+
+
+def test_git_handler_git_archive_symlink(tmp_dir):
+    assert {
+        'pkg/bar/README': b'hi',
+        'pkg/bar/docs': tarfile.DIRTYPE,
+        'pkg/bar/docs/README': '../README',
+    } == make_git_package_tar(tmp_dir, {'README': 'hi'},
+                              {'docs/README': '../README'}, git_archive=True)
+
+
+@pytest.mark.parametrize('linkname', ('/etc/passwd', '../../README'))
+def test_git_handler_git_archive_unsafe_symlink(tmp_dir, linkname):
+    with pytest.raises(ValueError):
+        make_git_package_tar(tmp_dir, {'README': 'hi'},
+                             {'docs/README': linkname}, git_archive=True)
+
+
+@pytest.mark.parametrize('depth,clone_options', (
+    (1, ['--depth=1', '--single-branch', '--no-tags']),
+    (10, ['--depth=10', '--single-branch', '--no-tags']),
+    (0, []),
+))
+def test_clone_git_repo_depth(tmp_dir, depth, clone_options):
+    fetch = make_fetch_desc(uri='https://github.com/foo/bar.git',
+                            type='git', name='bar', depth=depth)
+    with patch('git.Repo.clone_from') as clone_from:
+        clone_from.return_value.working_tree_dir = join(tmp_dir, 'bar')
+        custom_installer.clone_git_repo(None, fetch, tmp_dir)
+    clone_from.assert_called_once_with(
+        fetch.uri, join(tmp_dir, 'bar'), multi_options=clone_options)
@@ -65,7 +65,7 @@ def go_app_builder(build_context, target):
     """Pack a Go binary as a Docker image with its runtime dependencies."""
     yprint(build_context.conf, 'Build GoApp', target)
     prog = build_context.targets[target.props.main]
-    binary = list(prog.artifacts.get(AT.binary).keys())[0]
+    binary = next(iter(prog.artifacts.get(AT.binary)))
     entrypoint = ['/usr/src/bin/' + binary]
     build_app_docker_and_bin(
         build_context, target, entrypoint=entrypoint)
@@ -22,6 +22,7 @@ yabt config
 """
 
 
+from functools import lru_cache
 import os
 from os.path import abspath, relpath
 from pathlib import Path
@@ -40,6 +41,15 @@ YCONFIG_FILE = 'YConfig'
 YSETTINGS_FILE = 'YSettings'
 
 
+@lru_cache(maxsize=4096)
+def _host_to_buildenv_path(abs_host_path: str, project_root: str) -> str:
+    """Return a cached buildenv path for the absolute host path
+       `abs_host_path`."""
+    # TODO: windows-containers?
+    return '/'.join([
+        '/project', Path(relpath(abs_host_path, project_root)).as_posix()])
+
+
 class Config:
     """Runtime Config info class"""
 
@@ -52,6 +62,7 @@ class Config:
         'builders_workspace_dir',
         'cmd',
         'default_target_name',
+        'use_ccache',
         'use_fdebug_prefix_map_flag',
         'docker_volume',
         'flavor',
@@ -147,11 +158,20 @@ class Config:
         return os.path.join(self.project_root, self.builders_workspace_dir,
                             '.cache', 'artifacts')
 
+    def get_ccache_dir(self) -> str:
+        return os.path.join(self.project_root, self.builders_workspace_dir,
+                            '.cache', 'ccache')
+
+    def get_downloads_cache_dir(self) -> str:
+        return os.path.join(self.project_root, self.builders_workspace_dir,
+                            '.cache', 'downloads')
+
+    def get_ppa_signing_keys_cache_file(self) -> str:
+        return os.path.join(self.project_root, self.builders_workspace_dir,
+                            '.cache', 'ppa_signing_keys.json')
+
     def host_to_buildenv_path(self, host_path: str) -> str:
-        # TODO: windows-containers?
-        return '/'.join([
-            '/project',
-            Path(relpath(abspath(host_path), self.project_root)).as_posix()])
+        return _host_to_buildenv_path(abspath(host_path), self.project_root)
 
     def get(self, param: str, fallback: str) -> str:
         common_val, flavor_val = None, None
@@ -43,7 +43,8 @@ from .builders.custom_installer import get_installer_desc
 from .builders.nodejs import format_npm_specifier
 from .builders.ruby import format_gem_specifier
 from .pkgmgmt import (
-    format_apt_specifier, format_pypi_specifier, parse_apt_repository)
+    format_apt_specifier, format_pypi_specifier, parse_apt_repository,
+    resolve_ppa_signing_keys)
 from .target_utils import ImageCachingBehavior
 from .utils import link_node, rmtree
 
@@ -498,6 +499,7 @@ def build_docker_image(
 
     apt_key_cmds = []
     apt_repositories = []
+    resolve_ppa_signing_keys(build_context, apt_repo_deps)
     for dep in apt_repo_deps:
         source_line, apt_key_cmd = parse_apt_repository(
             build_context, dep, distro)
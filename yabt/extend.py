@@ -211,7 +211,7 @@ def register_builder_sig(
         attempts=1):
     Plugin.builders[builder_name].register_sig(
         builder_name, sig, docstring, cachable, attempts)
-    logger.debug('Registered {} builder signature'.format(builder_name))
+    logger.debug('Registered {} builder signature', builder_name)
 
 
 def register_build_func(builder_name):
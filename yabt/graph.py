@@ -295,6 +295,52 @@ def topological_sort(graph: networkx.DiGraph):
     yield from top_rev_sort_subgraph_stable(graph)
 
 
+def topological_sort_descendants(graph: networkx.DiGraph, source):
+    """Return all nodes reachable from `source` in `graph`, in the same order
+       that `topological_sort` would yield them.
+
+    Instead of sorting the entire graph and filtering out nodes that are not
+    reachable from `source`, this walks only the reachable subgraph once
+    (iterative DFS), computing for every node its height (longest path to a
+    leaf), which is exactly the round in which `top_rev_sort_subgraph_stable`
+    yields it - so sorting by (height, node) reproduces the stable order.
+    """
+    heights = {}
+    entered = set()
+    stack = [(source, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            heights[node] = max(
+                (heights[succ] + 1 for succ in graph.successors(node)),
+                default=0)
+            continue
+        if node in entered:
+            continue
+        entered.add(node)
+        stack.append((node, True))
+        stack.extend((succ, False) for succ in graph.successors(node)
+                     if succ not in entered)
+    del heights[source]
+    return sorted(heights, key=lambda node: (heights[node], node))
+
+
+def get_dependents_depths(graph: networkx.DiGraph) -> dict:
+    """Return a map from every node in `graph` to its depth - the length of
+       the longest path to it from a node that nothing depends on.
+
+    A node with a larger depth has a longer chain of dependents waiting for
+    it (it is on a more critical path of the graph).
+    """
+    depths = {}
+    for node in dag.topological_sort(graph):
+        depth = depths.setdefault(node, 0) + 1
+        for succ in graph.successors(node):
+            if depths.get(succ, 0) < depth:
+                depths[succ] = depth
+    return depths
+
+
 def get_descendants(graph: networkx.DiGraph, source):
     """Return all nodes reachable from `source` in `graph`."""
     return dag.descendants(graph, source)
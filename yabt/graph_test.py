@@ -25,6 +25,7 @@ yabt target graph tests
 from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 import random
+from types import SimpleNamespace
 from unittest.mock import Mock
 
 import hashlib
@@ -36,8 +37,8 @@ from . import test_utils as tu
 from .test_utils import generate_random_dag
 from .buildcontext import BuildContext
 from .graph import (
-        get_descendants, populate_targets_graph,
-        topological_sort, get_graph_roots,
+        get_dependents_depths, get_descendants, populate_targets_graph,
+        topological_sort, topological_sort_descendants, get_graph_roots,
         cut_from_graph
     )
 
@@ -174,6 +175,40 @@ def test_target_graph(basic_conf):
          ] == list(topological_sort(build_context.target_graph)))
 
 
+def test_topological_sort_descendants():
+    """Test that sorting descendants of a node matches the order of the
+       descendants in the topological sort of the entire graph."""
+    g = generate_random_dag(list(range(300)), 0, 10, 0.3)
+    top_sort_l = list(topological_sort(g))
+    for node in g.nodes():
+        descendants = get_descendants(g, node)
+        assert ([name for name in top_sort_l if name in descendants] ==
+                topological_sort_descendants(g, node))
+
+
+def test_get_dependents_depths():
+    """Test that node depths are the longest paths from the graph roots."""
+    g = networkx.DiGraph([('a', 'b'), ('b', 'c'), ('a', 'c'), ('d', 'c')])
+    g.add_node('e')
+    assert ({'a': 0, 'b': 1, 'c': 2, 'd': 0, 'e': 0} ==
+            get_dependents_depths(g))
+
+
+def test_target_iter_critical_path_first():
+    """Test that ready targets on the longest path of dependents are
+       generated first."""
+    g = networkx.DiGraph([(0, 1), (1, 2), (3, 4)])
+    build_context = BuildContext(Mock())
+    build_context.target_graph = g
+    for n in g.nodes():
+        build_context.targets[n] = SimpleNamespace(name=n)
+    order = []
+    for target in build_context.target_iter():
+        order.append(target.name)
+        target.done()
+    assert [2, 1, 4, 0, 3] == order
+
+
 @pytest.mark.usefixtures('in_yapi_dir')
 def test_target_graph_worldglob(basic_conf):
     """Test that building a graph with the world-glob specifier works."""
@@ -26,61 +26,209 @@ Factored from specialized handlers in cases that created import loops.
 """
 
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import json
+import os
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
+
 
+LAUNCHPAD_TIMEOUT = 10  # seconds
 
-LAUNCHPAD_URL = ('https://launchpad.net/api/1.0/'
-                 '~{ppa_owner}/+archive/{ppa_name}')
-LAUNCHPAD_SOURCE_LINE = ('deb http://ppa.launchpad.net/{ppa_owner}/{ppa_name}/'
-                         '{distro_id} {distro_codename} main')
-VALID_SOURCE_TYPES = frozenset(('deb',))  # 'deb-src'
+# A shared session, so Launchpad requests reuse connections (keep-alive)
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_JSON_HEADERS = {'Accept': 'application/json'}
+# A *thread-safe* map from (PPA owner, PPA name) to PPA signing key
+_PPA_SIGNING_KEYS = {}
+_PPA_SIGNING_KEYS_LOCK = threading.Lock()
+# Set of PPA signing keys cache files that were loaded into the map above
+_LOADED_PPA_CACHE_FILES = set()
 
 
 def format_apt_specifier(target):
-    if 'package' in target.props:
+    props = target.props
+    if 'package' in props:
         # AptPackage
-        if target.props.version:
-            return '{0.package}={0.version}'.format(target.props)
-        return target.props.package
+        if props.version:
+            return f'{props.package}={props.version}'
+        return props.package
 
     # AptGroup
     return ['='.join(pkg) if isinstance(pkg, tuple) else pkg
             for pkg in target.props.packages]
 
 
+def launchpad_url(ppa_owner: str, ppa_name: str) -> str:
+    """Return the Launchpad API URL of a PPA."""
+    return f'https://launchpad.net/api/1.0/~{ppa_owner}/+archive/{ppa_name}'
+
+
+def launchpad_source_line(ppa_owner: str, ppa_name: str, distro_id: str,
+                          distro_codename: str) -> str:
+    """Return the apt source line of a PPA for a distro."""
+    return (f'deb http://ppa.launchpad.net/{ppa_owner}/{ppa_name}/'
+            f'{distro_id} {distro_codename} main')
+
+
+def split_ppa(path: str):
+    """Return a (ppa_owner, ppa_name) tuple for a `ppa:` source `path`.
+
+    The PPA name defaults to "ppa" if not specified (e.g. `ppa:owner`).
+    """
+    ppa_owner, sep, ppa_name = path.partition(':')[2].partition('/')
+    if not sep:
+        ppa_name = 'ppa'
+    return ppa_owner, ppa_name
+
+
 def expand_ppa(path: str, distro: dict):
-    ppa = path.split(':')[1].split('/')
-    ppa_owner = ppa[0]
-    ppa_name = ppa[1] if len(ppa) > 0 else 'ppa'
-    source_line = LAUNCHPAD_SOURCE_LINE.format(
-        ppa_owner=ppa_owner, ppa_name=ppa_name,
-        distro_id=distro.get('id', 'ubuntu').lower(),
-        distro_codename=distro.get('codename', 'trusty'))
+    ppa_owner, ppa_name = split_ppa(path)
+    source_line = launchpad_source_line(
+        ppa_owner, ppa_name, distro.get('id', 'ubuntu').lower(),
+        distro.get('codename', 'trusty'))
     return source_line, ppa_owner, ppa_name
 
 
+def fetch_ppa_signing_key(ppa_owner: str, ppa_name: str) -> str:
+    """Return the signing key fingerprint of a PPA, as published on
+       Launchpad."""
+    # streaming, so the body is downloaded only after the status is checked
+    with _SESSION.get(
+            launchpad_url(ppa_owner, ppa_name), headers=_JSON_HEADERS,
+            timeout=LAUNCHPAD_TIMEOUT, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError('Failed getting PPA info for ppa:{}/{}'.format(
+                ppa_owner, ppa_name))
+        return json.loads(response.content)['signing_key_fingerprint']
+
+
+def get_ppa_cache_file(build_context):
+    """Return the path of the PPA signing keys cache file to use with
+       `build_context`, or None if it shouldn't be used."""
+    if build_context is None or build_context.conf.no_build_cache:
+        return None
+    return build_context.conf.get_ppa_signing_keys_cache_file()
+
+
+def load_ppa_signing_keys(cache_file: str):
+    """Load PPA signing keys that were saved to `cache_file` by previous
+       executions (once per cache file)."""
+    with _PPA_SIGNING_KEYS_LOCK:
+        if cache_file in _LOADED_PPA_CACHE_FILES:
+            return
+        _LOADED_PPA_CACHE_FILES.add(cache_file)
+        try:
+            with open(cache_file, 'r') as cache_f:
+                cached_keys = json.load(cache_f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return
+        for ppa, key in cached_keys.items():
+            _PPA_SIGNING_KEYS.setdefault(tuple(ppa.split('/', 1)), key)
+
+
+def save_ppa_signing_keys(cache_file: str):
+    """Save all known PPA signing keys to `cache_file` (atomically)."""
+    with _PPA_SIGNING_KEYS_LOCK:
+        cached_keys = {'/'.join(ppa): key
+                       for ppa, key in _PPA_SIGNING_KEYS.items()}
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(cache_file, threading.get_ident())
+        with open(tmp_file, 'w') as cache_f:
+            json.dump(cached_keys, cache_f, indent=4, sort_keys=True)
+        os.replace(tmp_file, cache_file)
+
+
+def get_ppa_signing_key(ppa_owner: str, ppa_name: str,
+                        cache_file: str=None) -> str:
+    """Return the signing key fingerprint of a PPA, fetching it from
+       Launchpad only if it wasn't fetched before.
+
+    If `cache_file` is given, keys are loaded from it before fetching, and
+    newly fetched keys are saved to it, so they're reused across executions.
+    """
+    ppa = (ppa_owner, ppa_name)
+    if cache_file and ppa not in _PPA_SIGNING_KEYS:
+        load_ppa_signing_keys(cache_file)
+    if ppa not in _PPA_SIGNING_KEYS:
+        key = fetch_ppa_signing_key(ppa_owner, ppa_name)
+        with _PPA_SIGNING_KEYS_LOCK:
+            _PPA_SIGNING_KEYS[ppa] = key
+        if cache_file:
+            save_ppa_signing_keys(cache_file)
+    return _PPA_SIGNING_KEYS[ppa]
+
+
+def resolve_ppa_signing_keys(build_context, targets, max_workers: int=8):
+    """Fetch the signing keys of all PPAs used as sources of apt repository
+       `targets` that were not fetched yet, concurrently.
+
+    Following calls to `parse_apt_repository` with these targets will not
+    need to access the network.
+    """
+    cache_file = get_ppa_cache_file(build_context)
+    if cache_file:
+        load_ppa_signing_keys(cache_file)
+    ppas = set(split_ppa(target.props.source) for target in targets
+               if target.props.source.startswith('ppa:'))
+    ppas.difference_update(_PPA_SIGNING_KEYS)
+    if len(ppas) < 2:
+        # nothing to gain from a thread pool
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(
+            lambda ppa: get_ppa_signing_key(*ppa, cache_file=cache_file),
+            ppas))
+
+
 def parse_apt_repository(build_context, target, distro):
-    source_line = target.props.source
+    """Return a (source_line, apt_key_cmd) tuple for an apt repository
+       `target` (apt_key_cmd may be None).
+
+    For PPA sources, the key of the `target` is set to the PPA signing key
+    fingerprint.
+
+    Results are memoized, so repositories that are referenced many times are
+    parsed (and PPAs fetched) only once.
+    """
+    props = target.props
+    if props.source.startswith('ppa:'):
+        source_line, props.key, apt_key_cmd = _parse_ppa_source(
+            props.source, props.keyserver, distro.get('id', 'ubuntu'),
+            distro.get('codename', 'trusty'),
+            get_ppa_cache_file(build_context))
+        return source_line, apt_key_cmd
+    return _parse_deb_source(props.source, props.key, props.keyserver)
+
+
+@lru_cache(maxsize=None)
+def _parse_ppa_source(source: str, keyserver: str, distro_id: str,
+                      distro_codename: str, cache_file: str):
+    """Return a (source_line, key, apt_key_cmd) tuple for a `ppa:` source."""
+    source_line, ppa_owner, ppa_name = expand_ppa(
+        source, {'id': distro_id, 'codename': distro_codename})
+    key = get_ppa_signing_key(ppa_owner, ppa_name, cache_file)
+    source_line, apt_key_cmd = _parse_deb_source(source_line, key, keyserver)
+    return source_line, key, apt_key_cmd
+
+
+@lru_cache(maxsize=None)
+def _parse_deb_source(source_line: str, key: str, keyserver: str):
+    """Return a (source_line, apt_key_cmd) tuple for a `deb` source line."""
     apt_key_cmd = None
-    # Parse PPA
-    if source_line.startswith('ppa:'):
-        source_line, ppa_owner, ppa_name = expand_ppa(source_line, distro)
-        response = requests.get(
-            LAUNCHPAD_URL.format(ppa_owner=ppa_owner, ppa_name=ppa_name),
-            headers={'Accept': 'application/json'})
-        if response.status_code != 200:
-            raise RuntimeError('Failed getting PPA info for {}'.format(target))
-        target.props.key = response.json()['signing_key_fingerprint']
     # Build apt-key command
-    if target.props.key:
-        apt_key_cmd = ('apt-key adv --keyserver {keyserver} --recv {key}'
-                       .format(**target.props))
+    if key:
+        apt_key_cmd = ('apt-key adv --keyserver {} --recv {}'
+                       .format(keyserver, key))
     # Clean up and validate apt source line
-    chunks = source_line.split('#', 1)[0].strip().split()
-    if not chunks or chunks[0] not in VALID_SOURCE_TYPES:
+    chunks = source_line.partition('#')[0].split()
+    # TODO: support also 'deb-src' source type?
+    if not chunks or chunks[0] != 'deb':
         raise ValueError('Invalid source line "{}"'.format(source_line))
-    source_line = ' '.join(chunks)
-    return source_line, apt_key_cmd
+    return ' '.join(chunks), apt_key_cmd
 
 
 def format_pypi_specifier(target):
@@ -162,10 +162,15 @@ def handle_typed_args(target, builder, build_module):
 
 def extractor(
         builder_name: str, builder: Builder, build_file_path: str,
-        build_context) -> types.FunctionType:
+        build_context, build_module: str=None) -> types.FunctionType:
     """Return a target extraction function for a specific builder and a
-       specific build file."""
-    build_module = to_build_module(build_file_path, build_context.conf)
+       specific build file.
+
+    `build_module` may be passed by callers that already computed it for
+    `build_file_path` (e.g. when creating extractors for all builders).
+    """
+    if build_module is None:
+        build_module = to_build_module(build_file_path, build_context.conf)
 
     def extract_target(*args, **kwargs):
         """The actual target extraction function that is executed when any
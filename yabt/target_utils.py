@@ -145,7 +145,34 @@ def process_prop(prop_type: PT, value, build_context):
     return value
 
 
-class Target(types.SimpleNamespace):  # pylint: disable=too-few-public-methods
+class Target:  # pylint: disable=too-few-public-methods
+
+    # Using slots for the common target attributes to keep the memory
+    # footprint of large target maps down.
+    # Attributes that specific builders (including out-of-tree plugins)
+    # attach to their targets go in the instance `__dict__`.
+    __slots__ = (
+        '__dict__',
+        'name',
+        'builder_name',
+        'props',
+        'deps',
+        'buildenv',
+        'tags',
+        'artifacts',
+        'summary',
+        'info',
+        'is_dirty',
+        'tested',
+        '_hash',
+        '_json',
+        '_test_hash',
+        '_test_json',
+        # build context ready-nodes callbacks
+        'done',
+        'retry',
+        'fail',
+    )
 
     _prop_json_blacklist = frozenset((
         'cachable',
@@ -157,38 +184,67 @@ class Target(types.SimpleNamespace):  # pylint: disable=too-few-public-methods
     ))
 
     def __init__(self, builder_name):
-        super().__init__(
-            name=None,
-            builder_name=builder_name,
-            props=Munch(),
-            deps=None,
-            buildenv=None,
-            tags=set(),
-            artifacts=ArtifactStore(),
-            summary={
-                'build_time': None,
-                'created': None,
-                'accessed': None,
-            },
-            info={
-                'test_time': None,
-                'fail_count': 0,
-            },
-            is_dirty=False,
-            tested={},
-            _hash=None,
-            _json=None,
-            _test_json=None,
-        )
+        self.name = None
+        self.builder_name = builder_name
+        self.props = Munch()
+        self.deps = None
+        self.buildenv = None
+        self.tags = set()
+        self.artifacts = ArtifactStore()
+        self.summary = {
+            'build_time': None,
+            'created': None,
+            'accessed': None,
+        }
+        self.info = {
+            'test_time': None,
+            'fail_count': 0,
+        }
+        self.is_dirty = False
+        self.tested = {}
+        self._hash = None
+        self._json = None
+        self._test_hash = None
+        self._test_json = None
 
     def __repr__(self):
         keys = ['name', 'builder_name', 'props', 'deps', 'buildenv', 'tags']
-        items = ('{}={!r}'.format(k, self.__dict__[k]) for k in keys)
+        items = ('{}={!r}'.format(k, getattr(self, k)) for k in keys)
         return '{}({})'.format(type(self).__name__, ', '.join(items))
 
-    def compute_target_json(self, build_context, prop_blacklist, deps_hashes):
+    def compute_props(self, build_context) -> dict:
+        """Return the processed props of this target for caching purposes
+           (excluding blacklisted & test props).
+
+        Target props are replaced with their hashes, and file props are
+        replaced with mapping from file name to its hash.
+        """
+        props = {}
+        for prop in self.props:
+            if prop in self._prop_json_blacklist:
+                continue
+            sig_spec = Plugin.builders[self.builder_name].sig.get(prop)
+            if sig_spec is None:
+                continue
+            if prop not in self._prop_json_testlist:
+                props[prop] = process_prop(sig_spec.type, self.props[prop],
+                                           build_context)
+        return props
+
+    def compute_target_json(self, build_context, prop_blacklist, deps_hashes,
+                            props: dict=None):
         """Compute a JSON serialization of this target for caching
-           purposes.
+           purposes (see `compute_target_dict`).
+        """
+        return json.dumps(
+            self.compute_target_dict(
+                build_context, prop_blacklist, deps_hashes, props),
+            sort_keys=True, indent=4)
+
+    def compute_target_dict(self, build_context, prop_blacklist, deps_hashes,
+                            props: dict=None) -> dict:
+        """Compute a JSON-serializable dict representing this target for
+           caching purposes.
 
         The serialization includes:
         - The build flavor
@@ -211,17 +267,14 @@ class Target(types.SimpleNamespace):  # pylint: disable=too-few-public-methods
 
         prop_blacklist - props we don't put in the json
         deps_hashes - precalculated hashes of direct dependencies
+        props - precalculated processed props (see `compute_props`), so
+                multiple serializations of the same target don't process
+                (and hash files of) the props over and over
         """
-        props = {}
-        for prop in self.props:
-            if prop in self._prop_json_blacklist or prop in prop_blacklist:
-                continue
-            sig_spec = Plugin.builders[self.builder_name].sig.get(prop)
-            if sig_spec is None:
-                continue
-            if prop not in self._prop_json_testlist:
-                props[prop] = process_prop(sig_spec.type, self.props[prop],
-                                           build_context)
+        if props is None:
+            props = self.compute_props(build_context)
+        props = {prop: value for prop, value in props.items()
+                 if prop not in prop_blacklist}
         json_dict = dict(
             # TODO: avoid including the name in the hashed json...
             name=self.name,
@@ -236,7 +289,7 @@ class Target(types.SimpleNamespace):  # pylint: disable=too-few-public-methods
         if build_context.conf.get('cache_salt', None) is not None:
             json_dict['cache_salt'] = build_context.conf.get('cache_salt',
                                                              None),
-        return json.dumps(json_dict, sort_keys=True, indent=4)
+        return json_dict
 
     def compute_test_json(self, build_context):
         """
@@ -27,7 +27,7 @@ import pytest
 
 from .buildcontext import BuildContext
 from .graph import populate_targets_graph
-from .target_utils import hashify_files, hashify_targets, norm_name
+from .target_utils import hashify_files, hashify_targets, norm_name, Target
 
 
 def test_norm_name_abs_ref():
@@ -93,8 +93,8 @@ def test_norm_name_unqualified_error():
             'possible ambiguity' in str(excinfo.value))
 
 
-_HELLO_PROG_HASH = 'aabad8062b3cb3ba305a8dc4eab2d19e'
-_PROTO_BUILDER = '8b411e2e06fa86d9d7301bb60d10d371'
+_HELLO_PROG_HASH = '195111047afa906cf3ff7863165cf639'
+_PROTO_BUILDER = 'e9e77ad7c4d2f354742a26c0433b484d'
 _BOTH_HASHES = list(sorted([_HELLO_PROG_HASH, _PROTO_BUILDER]))
 
 
@@ -154,6 +154,24 @@ def test_target_hash_and_json(basic_conf):
     assert _EXP_JSON == prog_app.json(build_context)
 
 
+@pytest.mark.usefixtures('in_proto_project')
+def test_target_json_precomputed_props(basic_conf):
+    build_context = BuildContext(basic_conf)
+    basic_conf.targets = ['app:hello-prog-app']
+    populate_targets_graph(build_context, basic_conf)
+    prog_app = build_context.targets['app:hello-prog-app']
+    props = prog_app.compute_props(build_context)
+    for prop_blacklist in ([], ['main']):
+        assert (prog_app.compute_target_json(
+                    build_context, prop_blacklist, ['foo']) ==
+                prog_app.compute_target_json(
+                    build_context, prop_blacklist, ['foo'], props))
+    assert '"main"' not in prog_app.compute_target_json(
+        build_context, ['main'], [], props)
+    # the precomputed props are not modified by blacklisting
+    assert 'main' in props
+
+
 @pytest.mark.usefixtures('in_proto_project')
 def test_hashify_targets(basic_conf):
     build_context = BuildContext(basic_conf)
@@ -173,3 +191,11 @@ def test_hashify_files():
         'tests/data/hello.txt': '910c8bc73110b0cd1bc5d2bcae782511',
         'tests/data/world.txt': '910c8bc73110b0cd1bc5d2bcae782511',
     } == hashed_files
+
+
+def test_target_builder_attributes():
+    """Builders (and plugins) may attach their own attributes to targets."""
+    target = Target('MyPluginBuilder')
+    assert not hasattr(target, 'my_plugin_state')
+    target.my_plugin_state = 'foo'
+    assert 'foo' == target.my_plugin_state